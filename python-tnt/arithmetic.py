@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+import functools
+
+import wff_quick
+from formula import Atom, Numeral, Successor, Term, numeral, successors
+
+def _term(t):
+    if isinstance(t, str):
+        s, t = t, wff_quick.parse(t)
+        if not isinstance(t, Term):
+            raise ValueError('not a term: %r' % s)
+    return t
+
+@functools.lru_cache(maxsize=1 << 16)
+def _value(t):
+    if isinstance(t, Numeral):
+        return t.n
+    if isinstance(t, Successor):
+        return t.k + _value(t.base)
+    left, right = t.operands
+    if t.symbol == '+':
+        return _value(left) + _value(right)
+    return _value(left) * _value(right)
+
+def value(t):
+    # The number that the definite term t stands for.
+    t = _term(t)
+    if t.free_variables:
+        raise ValueError('not a definite term: %s' % t)
+    return _value(t)
+
+def _equation(x, y):
+    return str(Atom(x, y))
+
+# Each definite term t gets a reduction: the numeral p that it equals,
+# the terms whose reductions have to come before it, and the steps
+# (s, rule) that then derive t=p. There's no rule for rewriting inside
+# a sum or a product, so the right operand of each + and ⋅ has to be a
+# numeral already, for the axioms to take apart. The left operand of a
+# + is only ever specified into them whole, but the left operand x of a
+# product (x⋅Sn) becomes the right operand of the sum ((x⋅n)+x), so it
+# has to be a numeral too (unless the product is by 0).
+@functools.lru_cache(maxsize=1 << 16)
+def _reduction(t):
+    p = numeral(value(t))
+    if isinstance(t, Numeral):
+        return p, (), ()
+    if isinstance(t, Successor):
+        before = successors(t.k - 1, t.base)
+        return p, (before,), ((_equation(t, p), 'successorship'),)
+    left, right = t.operands
+    if not isinstance(right, Numeral):
+        raise ValueError("can't reduce %s: its right operand isn't a numeral" % t)
+    if t.symbol == '+' and right.n == 0:
+        if isinstance(left, Numeral):
+            return p, (), ((_equation(t, p), 'specification'),)
+        return p, (left,), ((_equation(t, left), 'specification'), (_equation(t, p), 'equality'))
+    if t.symbol == '+':
+        before = Term('+', left, numeral(right.n - 1))
+        return p, (before,), (
+            (_equation(t, Term('S', before)), 'specification'),
+            (_equation(Term('S', before), p), 'successorship'),
+            (_equation(t, p), 'equality'),
+        )
+    if right.n == 0:
+        return p, (), ((_equation(t, p), 'specification'),)
+    if not isinstance(left, Numeral):
+        raise ValueError("can't reduce %s: its left operand isn't a numeral" % t)
+    total = Term('+', Term('⋅', left, numeral(right.n - 1)), left)
+    return p, (total,), (
+        (_equation(t, total), 'specification'),
+        (_equation(t, p), 'equality'),
+    )
+
+def _steps(terms, out, seen):
+    # Post-order over the reductions' dependencies, without recursion:
+    # a product's chain is as long as its value.
+    stack = [(t, False) for t in reversed(terms)]
+    while stack:
+        t, ready = stack.pop()
+        if ready:
+            for step in _reduction(t)[2]:
+                if step[0] not in seen:
+                    seen.add(step[0])
+                    out.append(step)
+        elif t not in seen:
+            seen.add(t)
+            stack.append((t, True))
+            stack.extend((x, False) for x in reversed(_reduction(t)[1]))
+
+@functools.lru_cache(maxsize=1 << 12)
+def chain(s):
+    # The steps (s′, rule) that derive the ground equation s from the axioms.
+    # Raises ValueError if s is false or beyond _reduction.
+    f = wff_quick.parse(s)
+    if not isinstance(f, Atom) or f.free_variables:
+        raise ValueError('not a ground equation: %r' % s)
+    x, y = f.left, f.right
+    p = numeral(value(x))
+    if p is not numeral(value(y)):
+        raise ValueError('false: %s' % s)
+    out, seen = [], set()
+    _steps([x, y], out, seen)
+    if isinstance(x, Numeral) and isinstance(y, Numeral):
+        # x=x, by way of (x+0)=x.
+        _steps([Term('+', x, numeral(0))], out, seen)
+        out.append((_equation(x, Term('+', x, numeral(0))), 'equality'))
+        out.append((s, 'equality'))
+    elif not isinstance(y, Numeral):
+        out.append((_equation(p, y), 'equality'))
+        if not isinstance(x, Numeral):
+            out.append((s, 'equality'))
+    return tuple(out)
+
+assert value('SS((SS0⋅SS0)+(S0⋅S0))') == 7 and value(numeral(10**9)) == 10**9
+assert [step for step, rule in chain('(S0+S0)=SS0')] == [
+    '(S0+0)=S0', '(S0+S0)=S(S0+0)', 'S(S0+0)=SS0', '(S0+S0)=SS0']
+assert chain('SS0=(S0+S0)')[-1] == ('SS0=(S0+S0)', 'equality')
+assert chain('((S0+S0)⋅0)=0')[-1] == ('((S0+S0)⋅0)=0', 'specification')
+for _s in ['((S0+S0)⋅S0)=SS0', '(S(S0+0)⋅SS0)=(SS0+SS0)', '(S0+(S0+0))=SS0']:
+    try:
+        chain(_s)
+        assert False
+    except ValueError:
+        pass
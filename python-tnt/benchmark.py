@@ -0,0 +1,566 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import collections
+import functools
+import importlib
+import io
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+import arithmetic
+import codec
+import derivation
+import instrument
+import proof_search
+import wff
+import wff_quick
+import workload
+from derivation import Derivation
+from formula import Atom, Compound, Not, Template, Term, numeral
+from godelize_mu import Encoder, MIUEncoder
+from model_check import ModelChecker
+from proof_search import ProofSearch
+
+def _big_formula(n_atoms, i=0):
+    # A balanced tree of implications and disjunctions over distinct atoms.
+    if n_atoms == 1:
+        return Not(Atom(Term('+', Term('a'), numeral(i % 7)), numeral(i)))
+    half = n_atoms // 2
+    op = '⊃' if (n_atoms % 3) else '∨'
+    return Compound(_big_formula(half, i), op, _big_formula(n_atoms - half, i + half))
+
+def bench_substitution():
+    print('%8s  %10s  %10s  %10s' % ('bytes', 'contrapos.', 'De Morgan', 'switcheroo'))
+    contrapositive = Template('<~Y⊃~X>'), Template('<X⊃Y>')
+    for n_atoms in [16, 32, 64, 128, 256]:
+        f = _big_formula(n_atoms)
+        s = str(f)
+        # The theorem is s with its innermost implication contraposed;
+        # the candidate step is s itself.
+        inner = f
+        while isinstance(inner.left, Compound):
+            inner = inner.left
+        bindings = contrapositive[1].match(inner)
+        theorem = s.replace(str(inner), str(contrapositive[0].build(bindings)), 1)
+        d = Derivation()
+        d.theorems.add(theorem)
+        timings = []
+        for check in [d.is_valid_by_contrapositive, d.is_valid_by_de_morgans, d.is_valid_by_switcheroo]:
+            start = time.time()
+            check(s)
+            timings.append(time.time() - start)
+        assert d.is_valid_by_contrapositive(s)
+        print('%8d  %9.4fs  %9.4fs  %9.4fs' % tuple([len(s.encode('utf-8'))] + timings))
+
+def _regex_tokens(s):
+    # How wff_quick used to classify its tokens: a re.split, and then
+    # a re.match or two for each token.
+    for token in re.split('(S*0)|(S*[a-z]′*)|(S+)|(.)', s):
+        if not token:
+            continue
+        if re.match('[a-z]′*$', token):
+            yield 'V'
+        elif re.match('(S*0)|(S*[a-z]′*)', token):
+            yield 'T'
+        elif re.match('S+', token):
+            yield 'S'
+        else:
+            yield token
+
+def _best_of(n, f, *args):
+    best = None
+    for i in range(n):
+        start = time.time()
+        f(*args)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def _left_nested(n):
+    # <<<x⊃y>⊃y>⊃y>, n deep, where y is itself a compound. Without memos,
+    # wff.py rechecks every prefix that starts with '<' and ends with '>',
+    # which doubles its time with each level. (The README's <x⊃⊃⊃⊃⊃⊃⊃⊃⊃y>
+    # isn't like that: every wrong split fails on its first character.)
+    s = '<a=0⊃a=0>'
+    for i in range(n):
+        s = '<%s⊃<a=0⊃a=0>>' % s
+    return s
+
+def bench_packrat():
+    print('%6s  %10s  %10s  %10s' % ('depth', 'wff', 'packrat', 'wff_quick'))
+    for n in [4, 8, 12, 14]:
+        s = _left_nested(n)
+        naive = _best_of(3, wff.is_well_formed_formula, s)
+        packrat = _best_of(3, wff.is_well_formed_formula, s, True)
+        quick = _best_of(3, wff_quick.check_well_formed_formula, s)
+        print('%6d  %9.4fs  %9.4fs  %9.4fs' % (n, naive, packrat, quick))
+
+def _module_at(revision, path, name):
+    # The module at path as of a git revision, or None outside a checkout.
+    try:
+        source = subprocess.run(['git', 'show', '%s:./%s' % (revision, path)], capture_output=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.decode('utf-8')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    module = types.ModuleType(name)
+    exec(compile(source, '%s@%s' % (path, revision), 'exec'), module.__dict__)
+    return module
+
+def bench_tokenizer():
+    # The whole check, against wff_quick as it was just before it got its
+    # own lexer, and the tokenizing alone, against the regexes it replaced.
+    mumon = str(MIUEncoder().mumon())
+    before = _module_at('4cff741^', 'wff_quick.py', 'wff_quick_before_lexer')
+    check = _best_of(20, wff_quick.check_well_formed_formula, mumon)
+    regex = _best_of(20, lambda: list(_regex_tokens(mumon)))
+    lexer = _best_of(20, lambda: list(wff_quick.tokenize(mumon)))
+    print('MUMON (%d characters)' % len(mumon))
+    if before is None:
+        print('  (not in a git checkout, so the old checker is not available)')
+    else:
+        assert before.check_well_formed_formula(mumon).is_well_formed
+        old = _best_of(20, before.check_well_formed_formula, mumon)
+        print('  check, before lexer %.6fs' % old)
+        print('  check, with lexer   %.6fs (%.1fx)' % (check, old / check))
+    print('  regex tokens        %.6fs' % regex)
+    print('  wff_quick.tokenize  %.6fs (%.1fx)' % (lexer, regex / lexer))
+
+def bench_encoder():
+    build = _best_of(5, lambda: MIUEncoder().mumon())
+    memoized = _best_of(5, lambda: MIUEncoder(memoize=True).mumon())
+    mumon = MIUEncoder().mumon()
+    serialize = _best_of(5, str, mumon)
+    stream = _best_of(5, mumon.write_to, io.StringIO())
+    print('MUMON (%d characters)' % len(mumon))
+    print('  build      %.6fs' % build)
+    print('  memoized   %.6fs (%d characters, alpha-equivalent)' % (memoized, len(MIUEncoder(memoize=True).mumon())))
+    print('  str()      %.6fs' % serialize)
+    print('  write_to   %.6fs' % stream)
+    e = MIUEncoder(memoize=True)
+    e.mumon()
+    for name, (hits, misses, rate) in sorted(e.hit_rates().items()):
+        print('  %-34s %3d hits %3d misses' % (name, hits, misses))
+
+class _Recording(Derivation):
+    # Records every step that succeeds, with the rule that justified it,
+    # so that whole derivations can be replayed later.
+    derivations = []
+    records = None
+
+    def __init__(self, fantasy_setup=None, **kwargs):
+        Derivation.__init__(self, fantasy_setup, **kwargs)
+        if fantasy_setup is None:
+            self.records = []
+            _Recording.derivations.append(self.records)
+
+    @classmethod
+    def resume(cls, path, **kwargs):
+        d = super(_Recording, cls).resume(path, **kwargs)
+        # A resumed derivation doesn't start from the axioms, so it can't be replayed.
+        _Recording.derivations.remove(d.records)
+        return d
+
+    def step(self, s, rule=None, using=None):
+        justification = 'handwave' if self.handwaving else (rule or self.justify(s))
+        Derivation.step(self, s, rule, using)
+        if self.records is not None:
+            self.records.append(('step', str(s), justification))
+
+    def begin_fantasy(self, premise):
+        f = Derivation.begin_fantasy(self, premise)
+        if self.records is not None:
+            f.records = self.records
+            self.records.append(('fantasy', str(premise)))
+        return f
+
+    def end_fantasy(self):
+        if self.records is not None:
+            self.records.append(('end',))
+        Derivation.end_fantasy(self)
+
+    def abandon_fantasy(self):
+        if self.records is not None:
+            self.records.append(('abandon',))
+        Derivation.abandon_fantasy(self)
+
+def recorded_examples():
+    # The records of each derivation in derivation_examples.py.
+    _Recording.derivations = []
+    derivation.Derivation = _Recording
+    try:
+        sys.modules.pop('derivation_examples', None)
+        importlib.import_module('derivation_examples')
+    finally:
+        derivation.Derivation = Derivation
+    return _Recording.derivations
+
+def replay(records, tagged):
+    # Returns (rule, seconds) for each step.
+    frames = [Derivation()]
+    timings = []
+    for record in records:
+        if record[0] == 'step':
+            s, rule = record[1], record[2]
+            d = frames[-1]
+            if rule == 'handwave':
+                d.handwave()
+            start = time.time()
+            d.step(s, rule=rule if tagged and rule != 'handwave' else None)
+            timings.append((rule, time.time() - start))
+        elif record[0] == 'fantasy':
+            frames.append(frames[-1].begin_fantasy(record[1]))
+        else:
+            frames.pop()
+            if record[0] == 'end':
+                frames[-1].end_fantasy()
+            else:
+                frames[-1].abandon_fantasy()
+    return timings
+
+def bench_tagged_steps():
+    examples = recorded_examples()
+    by_rule = collections.defaultdict(lambda: [0, 0.0, 0.0])
+    for tagged in [False, True]:
+        for i in range(20):
+            for records in examples:
+                for rule, seconds in replay(records, tagged):
+                    by_rule[rule][0] += (not tagged)
+                    by_rule[rule][1 + tagged] += seconds
+    print('%-16s %6s %12s %12s' % ('rule', 'steps', 'untagged', 'tagged'))
+    total = [0, 0.0, 0.0]
+    for rule in sorted(by_rule):
+        n, untagged, tagged = by_rule[rule]
+        total = [total[0] + n, total[1] + untagged, total[2] + tagged]
+        print('%-16s %6d %10.1fus %10.1fus' % (rule, n // 20, 1e6 * untagged / n, 1e6 * tagged / n))
+    n, untagged, tagged = total
+    print('%-16s %6d %10.1fus %10.1fus' % ('(all)', n // 20, 1e6 * untagged / n, 1e6 * tagged / n))
+
+def bench_formula_cache():
+    # Validating a library of formulas in a fresh process: without the
+    # cache, with an empty one (which fills it) and with a full one.
+    library = sorted(set([record[1] for records in recorded_examples() for record in records if record[0] == 'step'] + [
+        str(MIUEncoder().mumon()),
+        str(MIUEncoder().s_is_derivable_from_t('s', 't')),
+        str(Encoder().a_raised_to_b_is_c(Encoder().numeral(10), 'c', 'b')),
+    ]))
+
+    def validate(path):
+        wff_quick.parse.cache_clear()
+        start = time.perf_counter()
+        wff_quick.use_cache(path)
+        assert all(wff_quick.is_well_formed_formula(s) for s in library)
+        wff_quick.use_cache(None)
+        return time.perf_counter() - start
+
+    path = os.path.join(tempfile.mkdtemp(), 'formulas.sqlite')
+    plain = min(validate(None) for i in range(5))
+    cold = validate(path)
+    warm = min(validate(path) for i in range(5))
+    os.remove(path)
+    print('%d formulas, %d characters' % (len(library), sum(len(s) for s in library)))
+    print('  wff_quick      %.4fs' % plain)
+    print('  cache, cold    %.4fs' % cold)
+    print('  cache, warm    %.4fs (%.1fx)' % (warm, plain / warm))
+
+def bench_fantasy():
+    # Entering a fantasy used to cost a copy of the whole bag of theorems.
+    print('%8s  %12s  %12s  %12s' % ('theorems', 'copy', 'fantasy', 'lookup'))
+    for n in [10, 1000, 30000]:
+        d = Derivation()
+        for i in range(n):
+            d.theorems.add(str(Atom(Term('+', numeral(i % 30), numeral(i // 30 % 30)), numeral(i // 900))))
+        copy = _best_of(3, d.theorems.copy)
+        start = time.time()
+        for i in range(100):
+            with d.fantasy('b=0') as f:
+                pass
+        entering = (time.time() - start) / 100
+        with d.fantasy('b=0') as f:
+            start = time.time()
+            for i in range(1000):
+                f.is_valid_by_equality('(a+0)=0')
+            lookup = (time.time() - start) / 1000
+        print('%8d  %10.1fus  %10.1fus  %10.1fus' % (n, 1e6 * copy, 1e6 * entering, 1e6 * lookup))
+
+def bench_proof_search():
+    print('%-26s %6s %9s %9s %9s %10s' % ('target', 'found', 'expanded', 'frontier', 'seconds', 'checks/s'))
+    for target in ['S0=S0', '(S0+S0)=SS0', '(0+a)=a', '<p=0∨~p=0>', '∀a:∀b:<~a=b⊃~Sa=Sb>']:
+        search = ProofSearch(target)
+        found = search.run() is not None
+        stats = search.stats
+        print('%-26s %6s %9d %9d %8.3fs %10.0f' % (target, found, stats['expanded'], stats['max_frontier'], stats['seconds'], search.rate()))
+
+def bench_parallel_search():
+    # A goal that's out of reach, so that every run searches the same
+    # (wide) space until it runs out of budget.
+    print('%d CPUs' % os.cpu_count())
+    print('%8s  %9s  %9s  %12s' % ('workers', 'derived', 'seconds', 'theorems/s'))
+    for workers in [1, 2, 4, 8, 16, 32]:
+        if workers > 2 * os.cpu_count():
+            break
+        search = ProofSearch('(a+b)=(b+a)', max_nodes=3000, workers=workers)
+        search.run()
+        stats = search.stats
+        print('%8d  %9d  %8.2fs  %12.0f' % (workers, stats['derived'], stats['seconds'], stats['derived'] / stats['seconds']))
+
+def bench_codec():
+    corpora = [
+        ('MUMON', [str(MIUEncoder().mumon())]),
+        ('big formula', [str(_big_formula(256))]),
+        ('numerals', [str(Atom(Term('+', numeral(i), numeral(i)), numeral(2*i))) for i in range(300)]),
+        ('examples', [record[1] for records in recorded_examples() for record in records if record[0] == 'step']),
+    ]
+    print('%-12s %9s %9s %6s  %10s %10s %10s %10s' % (
+        'corpus', 'UTF-8', 'codec', 'ratio', 'enc MB/s', 'dec MB/s', 'utf8 enc', 'utf8 dec'))
+    for name, formulas in corpora:
+        text = '\n'.join(formulas).encode('utf-8')
+        archive = codec.dump(formulas)
+        assert list(codec.load(archive)) == formulas
+        mb = len(text) / 1e6
+        times = [
+            _best_of(5, codec.dump, formulas),
+            _best_of(5, lambda: list(codec.load(archive))),
+            _best_of(5, lambda: '\n'.join(formulas).encode('utf-8')),
+            _best_of(5, lambda: text.decode('utf-8').split('\n')),
+        ]
+        print('%-12s %9d %9d %5.2fx  %10.1f %10.1f %10.1f %10.1f' % (
+            (name, len(text), len(archive), len(text) / len(archive)) + tuple(mb / t for t in times)))
+    mumon = corpora[0][1][0]
+    print('Gödel number of MUMON (%d digits): %.6fs' % (3 * len(mumon), _best_of(5, codec.godel_number, mumon)))
+
+def bench_numerals():
+    print('%9s  %10s  %12s  %10s' % ('S\'s', 'parse', 'successorship', 'is_term'))
+    for n in [10, 1000, 100000, 1000000]:
+        d = Derivation()
+        d.theorems.add('%s=%s' % (numeral(n), numeral(n)))
+        s = str(Atom(numeral(n + 1), numeral(n + 1)))
+        parse = _best_of(3, wff_quick.check_well_formed_formula, s)
+        successorship = _best_of(3, d.is_valid_by_successorship, s)
+        term = _best_of(3, wff.is_term, str(numeral(n)))
+        print('%9d  %9.4fs  %11.6fs  %9.4fs' % (n, parse, successorship, term))
+
+def bench_arithmetic():
+    lemmas = ['%s=%s' % (Term(op, numeral(m), numeral(n)), numeral(m + n if op == '+' else m * n))
+              for op in '+⋅' for m in range(1, 12) for n in range(12)]
+    start = time.time()
+    n_steps = sum(len(arithmetic.chain(s)) for s in lemmas)
+    cold = time.time() - start
+    cached = _best_of(3, lambda: [arithmetic.chain(s) for s in lemmas])
+    d = Derivation()
+    start = time.time()
+    for s in lemmas:
+        d.calculate(s)
+    stepping = time.time() - start
+    print('%d lemmas, %d steps in their chains, %d theorems in the bag' % (len(lemmas), n_steps, len(d.theorems)))
+    print('  chains         %.4fs' % cold)
+    print('  chains again   %.4fs' % cached)
+    print('  calculate      %.4fs (%.1fus per new theorem)' % (stepping, 1e6 * stepping / len(d.theorems)))
+
+def bench_model_check():
+    # Candidate steps that are all false, most of them arithmetic that
+    # only the equality and successorship rules would get to look at.
+    d = Derivation()
+    for m in range(6):
+        for n in range(6):
+            d.calculate('(%s+%s)=%s' % (numeral(m), numeral(n), numeral(m + n)))
+    candidates = ['(%s+%s)=%s' % (numeral(m), numeral(n), numeral(k)) for m in range(6) for n in range(6) for k in range(12) if k != m + n]
+    candidates += ['∀a:(a+%s)=(%s+a)' % (numeral(n), numeral(n + 1)) for n in range(6)]
+    candidates += ['<(a+%s)=b⊃a=b>' % numeral(n) for n in range(1, 5)]
+    model = ModelChecker()
+    assert not any(d.justify(s) for s in candidates) and all(model.refutes(s) for s in candidates)
+    rules = _best_of(3, lambda: [d.justify(s) for s in candidates])
+    refute = _best_of(3, lambda: [model.refutes(s) for s in candidates])
+    print('%d false candidate steps' % len(candidates))
+    print('  all the rules      %.4fs' % rules)
+    print('  model_check        %.4fs (%.1fx)' % (refute, rules / refute))
+
+def bench_instrument():
+    # The cost of the instrumentation when it's off, on calls too quick
+    # for anything else to hide it, and of recording a whole replay.
+    d = Derivation()
+    check = d.is_valid_by_successorship
+    raw = functools.partial(Derivation.is_valid_by_successorship.__wrapped__, d)
+    parse = wff_quick.check_well_formed_formula
+    for name, f, arg in [('successorship check', check, 'S0=S0'), ('   (uninstrumented)', raw, 'S0=S0'),
+                         ('parse 0=0', parse, '0=0'), ('   (uninstrumented)', parse.__wrapped__, '0=0')]:
+        print('  %-24s %8.3fus' % (name, 1e6 * _best_of(5, lambda: [f(arg) for i in range(10000)]) / 10000))
+    examples = recorded_examples()
+    off = _best_of(3, lambda: [replay(records, False) for records in examples])
+    with instrument.Stats(trace=True) as stats:
+        on = _best_of(3, lambda: [replay(records, False) for records in examples])
+    print('  replay, off              %8.4fs' % off)
+    print('  replay, recording        %8.4fs (%d events)' % (on, len(stats.events)))
+
+def bench_workload():
+    for name, make in [('formulas', workload.formulas), ('near misses', workload.near_misses)]:
+        start = time.time()
+        corpus = list(make(0, 2000, size=16))
+        made = time.time() - start
+        start = time.time()
+        verdicts = list(wff_quick.check_many(corpus))
+        checked = time.time() - start
+        mb = sum(len(s.encode('utf-8')) for s in corpus) / 1e6
+        print('%-12s %6d formulas, %.2f MB: generated at %.2f MB/s, checked at %.2f MB/s (%d well-formed)' % (
+            name, len(corpus), mb, mb / made, mb / checked, sum(f.is_well_formed for f in verdicts)))
+    start = time.time()
+    records = list(workload.derivation(0, steps=5000))
+    made = time.time() - start
+    start = time.time()
+    proof_search.replay(records, Derivation())
+    replayed = time.time() - start
+    print('derivation   %6d records: generated in %.2fs, replayed in %.2fs' % (len(records), made, replayed))
+
+def bench_specification():
+    # Universals whose bodies all have the same shape, so the shape index
+    # can't tell them apart, and a candidate that specifies only one.
+    print('%8s  %12s  %12s  %12s' % ('theorems', 'shape scan', 'tree', 'tree, miss'))
+    for n in [10, 1000, 30000]:
+        d = Derivation()
+        for i in range(n):
+            d.theorems.add('∀a:(a+%s)=(%s+a)' % (numeral(i % 100), numeral(i // 100)))
+        i = n - 1
+        hit = '(S0+%s)=(%s+S0)' % (numeral(i % 100), numeral(i // 100))
+        miss = '(S0+%s)=(%s+S0)' % (numeral(i % 100), numeral(i // 100 + 1))
+        scan = _best_of(3, lambda: any(d._is_substitution_of_some_term_for_variable(u, x, hit)
+                                       for u, x in d.theorems.universals_with_body_shaped_like(hit)))
+        tree = _best_of(3, d.is_valid_by_specification, hit)
+        missing = _best_of(3, d.is_valid_by_specification, miss)
+        print('%8d  %10.1fus  %10.1fus  %10.1fus' % (n, 1e6 * scan, 1e6 * tree, 1e6 * missing))
+    # A run of S's is one node in the tree, however long it is.
+    print('%9s  %12s  %12s' % ('S\'s', 'index', 'specify'))
+    for n in [10, 1000, 1000000]:
+        d = Derivation()
+        universal = '∀b:(b+%s)=b' % numeral(n)
+        index = _best_of(3, lambda: d.theorems.child().add(universal))
+        d.theorems.add(universal)
+        specify = _best_of(3, d.is_valid_by_specification, '(%s+0)=%s' % (numeral(n), numeral(n)))
+        print('%9d  %10.1fus  %10.1fus' % (n, 1e6 * index, 1e6 * specify))
+
+BENCHMARKS = {
+    'arithmetic': bench_arithmetic,
+    'codec': bench_codec,
+    'encoder': bench_encoder,
+    'fantasy': bench_fantasy,
+    'formula_cache': bench_formula_cache,
+    'numerals': bench_numerals,
+    'packrat': bench_packrat,
+    'instrument': bench_instrument,
+    'model_check': bench_model_check,
+    'parallel_search': bench_parallel_search,
+    'proof_search': bench_proof_search,
+    'specification': bench_specification,
+    'substitution': bench_substitution,
+    'tagged_steps': bench_tagged_steps,
+    'tokenizer': bench_tokenizer,
+    'workload': bench_workload,
+}
+
+# The suite: a fixed set of measurements, written out as JSON so that
+# two runs (say, before and after a change) can be compared.
+
+def _per_call(repeat, f, *args):
+    # Best of repeat, each timing enough calls to take a millisecond or so.
+    start = time.perf_counter()
+    f(*args)
+    number = max(1, min(1000, int(0.001 / max(time.perf_counter() - start, 1e-7))))
+    return _best_of(repeat, lambda: [f(*args) for i in range(number)]) / number
+
+PARSING_FAMILIES = {
+    # <0=0⊃<0=0⊃...0=0>>, d deep.
+    # (wff.py recurses once per level, so this stays under the recursion limit.)
+    'nesting': (lambda d: '<0=0⊃' * d + '0=0' + '>' * d, [4, 16, 64, 128]),
+    'numeral': (lambda n: 'S' * n + '0=0', [10, 100, 1000, 10000]),
+    # The README's <x⊃⊃⊃⊃⊃⊃⊃⊃⊃y>, with atoms for x and y. Every wrong
+    # split fails at once, so it's linear even for wff.
+    'arrows': (lambda n: '<a=0' + '⊃' * n + 'b=0>', [4, 16, 64, 256]),
+    # Exponential for wff without memos; a packrat regression shows here.
+    'left_nested': (_left_nested, [4, 8, 12]),
+}
+
+PARSERS = {
+    'wff': wff.is_well_formed_formula,
+    'wff_packrat': functools.partial(wff.is_well_formed_formula, packrat=True),
+    'wff_quick': wff_quick.check_well_formed_formula,
+}
+
+def suite_parsing(repeat):
+    for family, (make, sizes) in sorted(PARSING_FAMILIES.items()):
+        for n in sizes:
+            for parser, check in sorted(PARSERS.items()):
+                yield 'parse/%s/%d/%s' % (family, n, parser), _per_call(repeat, check, make(n))
+
+def suite_replay(repeat):
+    # Each step of each derivation in derivation_examples.py, untagged,
+    # best of repeat replays.
+    for i, records in enumerate(recorded_examples()):
+        runs = [replay(records, False) for r in range(repeat)]
+        for j, timings in enumerate(zip(*runs)):
+            yield 'replay/%d/%d/%s' % (i, j, timings[0][0]), min(seconds for rule, seconds in timings)
+
+def suite_mumon(repeat):
+    mumon = MIUEncoder().mumon()
+    yield 'mumon/build', _per_call(repeat, lambda: MIUEncoder().mumon())
+    yield 'mumon/build_memoized', _per_call(repeat, lambda: MIUEncoder(memoize=True).mumon())
+    yield 'mumon/str', _per_call(repeat, lambda: ''.join(mumon.pieces()))
+    yield 'mumon/wff_quick', _per_call(repeat, wff_quick.check_well_formed_formula, str(mumon))
+
+SUITE = [suite_parsing, suite_replay, suite_mumon]
+
+def run_suite(repeat=5):
+    meta = {
+        'python': sys.version.split()[0],
+        'platform': sys.platform,
+        'cpus': os.cpu_count(),
+        'repeat': repeat,
+    }
+    seconds = {}
+    for suite in SUITE:
+        seconds.update(suite(repeat))
+    return {'meta': meta, 'seconds': seconds}
+
+def compare(old, new, threshold=0.2, min_seconds=5e-6):
+    # The measurements that got slower by more than threshold (a fraction)
+    # and by more than min_seconds.
+    regressions = []
+    for name in sorted(set(old['seconds']) & set(new['seconds'])):
+        a, b = old['seconds'][name], new['seconds'][name]
+        if b > a * (1 + threshold) and b - a > min_seconds:
+            regressions.append((name, a, b))
+    return regressions
+
+assert compare({'seconds': {'x': 1.0, 'y': 1.0, 'z': 1.0}}, {'seconds': {'x': 1.1, 'y': 2.0}}) == [('y', 1.0, 2.0)]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the expensive parts of python-tnt.')
+    parser.add_argument('benchmarks', nargs='*', help='which of the printed benchmarks to run (default: all)')
+    parser.add_argument('--json', metavar='PATH', help='run the suite instead, and write its results to PATH')
+    parser.add_argument('--repeat', type=int, default=5, help='take the best of this many runs of each measurement')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='list the regressions from one run of the suite to another')
+    parser.add_argument('--threshold', type=float, default=0.2, help='how much slower counts as a regression (default 0.2, for 20%%)')
+    parser.add_argument('--min-seconds', type=float, default=5e-6, help='and by at least this much (default 5e-6)')
+    args = parser.parse_args()
+    if args.compare:
+        runs = []
+        for path in args.compare:
+            with open(path, encoding='utf-8') as f:
+                runs.append(json.load(f))
+        regressions = compare(runs[0], runs[1], args.threshold, args.min_seconds)
+        for name, a, b in regressions:
+            print('%-48s %10.1fus -> %10.1fus (%+.0f%%)' % (name, 1e6 * a, 1e6 * b, 100 * (b / a - 1)))
+        print('%d regressions out of %d measurements' % (len(regressions), len(set(runs[0]['seconds']) & set(runs[1]['seconds']))))
+        sys.exit(1 if regressions else 0)
+    elif args.json:
+        results = run_suite(args.repeat)
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=1, sort_keys=True, ensure_ascii=False)
+    else:
+        for name in (args.benchmarks or sorted(BENCHMARKS)):
+            print('== %s ==' % name)
+            BENCHMARKS[name]()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+import functools
+
+import wff_quick
+from wff_quick import NUMERAL, VARIABLE, SUCCESSOR_TERM, SUCCESSORS, SYMBOLS, tokenize
+
+# The binary format is one byte per token of wff_quick.tokenize: the
+# token's kind in the low 5 bits, and in the top 3 bits its number of
+# leading S's, up to 6. A 7 there means the rest of the count follows
+# as a varint. Variables follow as the varint letter + 26*primes. So an
+# operator takes 1 byte instead of UTF-8's 1 to 3, and a numeral takes
+# 1 byte (2 up to S^134 0) instead of one per S.
+_INLINE = 7
+
+def _put_varint(out, n):
+    while n >= 0x80:
+        out.append(n & 0x7f | 0x80)
+        n >>= 7
+    out.append(n)
+
+def _get_varint(buf, i):
+    n = shift = 0
+    while True:
+        b = buf[i]
+        i += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n, i
+        shift += 7
+
+def _variable_code(v):
+    return (ord(v[0]) - ord('a')) + 26 * (len(v) - 1)
+
+def _variable_name(code):
+    return chr(ord('a') + code % 26) + '′' * (code // 26)
+
+def encode(s, out=None):
+    # Appends the encoding of the well-formed formula s to out.
+    s = str(s)
+    if not wff_quick.is_well_formed_formula(s):
+        raise ValueError('not a well-formed formula: %r' % s)
+    if out is None:
+        out = bytearray()
+    for kind, start, end, n in tokenize(s):
+        if kind > SUCCESSORS:
+            out.append(kind)
+            continue
+        out.append(kind | min(n, _INLINE) << 5)
+        if n >= _INLINE:
+            _put_varint(out, n - _INLINE)
+        if kind == VARIABLE or kind == SUCCESSOR_TERM:
+            _put_varint(out, _variable_code(s[start+n:end]))
+    return out
+
+def decode(buf, start=0, end=None):
+    # Read through a memoryview, so nothing gets copied.
+    view = memoryview(buf)
+    if end is None:
+        end = len(view)
+    pieces = []
+    i = start
+    while i < end:
+        b = view[i]
+        i += 1
+        kind, n = b & 0x1f, b >> 5
+        if kind > SUCCESSORS:
+            pieces.append(SYMBOLS[kind])
+            continue
+        if n == _INLINE:
+            extra, i = _get_varint(view, i)
+            n += extra
+        pieces.append('S' * n)
+        if kind == NUMERAL:
+            pieces.append('0')
+        elif kind != SUCCESSORS:
+            code, i = _get_varint(view, i)
+            pieces.append(_variable_name(code))
+    return ''.join(pieces)
+
+def dump(formulas):
+    # Each formula's encoding, preceded by its length as a varint.
+    out, scratch = bytearray(), bytearray()
+    for s in formulas:
+        del scratch[:]
+        encode(s, scratch)
+        _put_varint(out, len(scratch))
+        out += scratch
+    return bytes(out)
+
+def records(buf):
+    view = memoryview(buf)
+    i = 0
+    while i < len(view):
+        n, i = _get_varint(view, i)
+        yield view[i:i+n]
+        i += n
+
+def load(buf):
+    for record in records(buf):
+        yield decode(record)
+
+# Gödel numbering, as in Chapter 9, where each symbol is a three-digit
+# codon. TNT there only has the variable letter a (and primes); the other
+# letters get codons of their own, 701 for b up to 725 for z.
+CODONS = {
+    '0': 666, 'S': 123, '=': 111, '+': 112, '⋅': 236, '(': 362, ')': 323,
+    '<': 212, '>': 213, 'a': 262, '′': 163,
+    '∧': 161, '∨': 616, '⊃': 633, '~': 223, '∃': 333, '∀': 626, ':': 636,
+}
+CODONS.update((c, 700 + ord(c) - ord('a')) for c in 'bcdefghijklmnopqrstuvwxyz')
+SYMBOLS_BY_CODON = dict((codon, c) for c, codon in CODONS.items())
+
+@functools.lru_cache()
+def _power(k):
+    return 1000 ** k
+
+def _combine(codons, i, j):
+    # Divide and conquer, so that a long formula's number costs a few big
+    # multiplications instead of one per symbol.
+    if j - i <= 64:
+        n = 0
+        for codon in codons[i:j]:
+            n = 1000 * n + codon
+        return n
+    m = (i + j) // 2
+    return _combine(codons, i, m) * _power(j - m) + _combine(codons, m, j)
+
+def _split(n, k, out):
+    if k <= 64:
+        codons = []
+        for i in range(k):
+            n, codon = divmod(n, 1000)
+            codons.append(SYMBOLS_BY_CODON[codon])
+        out.extend(reversed(codons))
+        return
+    high, low = divmod(n, _power(k // 2))
+    _split(high, k - k // 2, out)
+    _split(low, k // 2, out)
+
+def godel_number(s):
+    codons = [CODONS[c] for c in s]
+    return _combine(codons, 0, len(codons))
+
+def godel_digits(s):
+    # The digits of s's Gödel number are just its codons in a row.
+    return ''.join(str(CODONS[c]) for c in s)
+
+def from_godel_number(n):
+    # No codon starts with a 0, so n has exactly 3 digits per symbol.
+    k = max(1, n.bit_length() * 3 // 31)
+    while _power(k) <= n:
+        k += 1
+    while k > 1 and _power(k - 1) > n:
+        k -= 1
+    out = []
+    _split(n, k, out)
+    return ''.join(out)
+
+_formulas = ['∀a′:<S(a′+0)=SSb∨~SSSSSSSSSS0=0>', '∃z′′:(z′′⋅SSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSS0)=z′′']
+assert list(load(dump(_formulas))) == _formulas
+assert len(encode(_formulas[0])) == 22 and len(_formulas[0].encode('utf-8')) == 40
+assert godel_number('0=0') == 666111666 and godel_digits('S0=S0') == '123666111123666'
+assert from_godel_number(godel_number(_formulas[1] * 3)) == _formulas[1] * 3
@@ -1,20 +1,56 @@
 # -*- coding: utf-8 -*-
 
 import contextlib
+import functools
 import re
 
+import arithmetic
+import instrument
+import journal
 import wff_quick as wff
+from formula import Atom, Compound, Formula, Not, Template, rewrites_of_one_subformula, successors
+from theorem_store import TheoremStore
 from wff import is_term, is_variable
 
+_template = functools.lru_cache()(Template)
+
+def _top_level_shape(f):
+    if isinstance(f, Atom):
+        return '='
+    elif isinstance(f, Not):
+        return '~'
+    elif isinstance(f, Compound):
+        return f.op
+    return f.quantifier
+
+# Besides the top-level shape, these rules need s to contain certain
+# symbols. The rewriting rules need a subformula that their templates
+# match. Interchange needs a quantifier to flip. Transitivity looks up
+# the text before the first '=', and that text is only the left side of
+# some theorem if it has no '<'.
+_requirements = {
+    'contrapositive': lambda s: '⊃' in s,
+    'de_morgans': lambda s: '∧' in s or '∨' in s,
+    'switcheroo': lambda s: '∨' in s or '⊃' in s,
+    'interchange': lambda s: '∀' in s or '∃' in s,
+    'equality': lambda s: '<' not in s[:s.find('=')],
+}
+
 class InvalidStep(Exception):
     pass
 
 class Derivation:
-    def __init__(self, fantasy_setup=None):
+    def __init__(self, fantasy_setup=None, log=None, snapshot_every=1000, model=None):
         self.handwaving = False
+        # A model_check.ModelChecker turns down steps that are false in the
+        # natural numbers before any rule gets tried. That's only sound if
+        # everything in the bag is true, so fantasies don't get one.
+        self.model = model if fantasy_setup is None else None
+        self.child = None
+        self.journal = None
         if fantasy_setup is None:
             self.premise = None
-            self.theorems = set([
+            self.theorems = TheoremStore([
                 '∀a:~Sa=0',
                 '∀a:(a+0)=a',
                 '∀a:∀b:(a+Sb)=S(a+b)',
@@ -26,26 +62,23 @@ class Derivation:
             self.premise, self.theorems = fantasy_setup
             self.theorems.add(self.premise)
             self.conclusion = self.premise
+        if log is not None:
+            self.journal = journal.Journal(log, snapshot_every)
+            self.journal.frames.append(self)
 
     def is_valid_by_joining(self, s):
         if s[0] == '<' and s[-1] == '>':
             for i in range(len(s)):
                 if s[i] == '∧':
                     first, second = s[1:i], s[i+1:-1]
-                    if set([first, second]) <= self.theorems:
+                    if first in self.theorems and second in self.theorems:
                         return True
         return False
 
     def is_valid_by_separation(self, s):
         if not wff.is_well_formed_formula(s):
             return False
-        for theorem in self.theorems:
-            if theorem[0] == '<' and theorem[-1] == '>':
-                if theorem.startswith('<%s∧' % s):
-                    return True
-                if theorem.endswith('∧%s>' % s):
-                    return True
-        return False
+        return self.theorems.is_conjunct(s)
 
     def is_removal_of_double_tilde(self, shorter, longer):
         if len(shorter)+2 == len(longer):
@@ -59,37 +92,28 @@ class Derivation:
         if not wff.is_well_formed_formula(s):
             return False
 
-        for theorem in self.theorems:
+        for theorem in self.theorems.theorems_differing_only_in_tildes_from(s):
             if self.is_removal_of_double_tilde(s, theorem) or self.is_removal_of_double_tilde(theorem, s):
                 return True
         return False
 
     def is_valid_by_detachment(self, s):
-        for theorem in self.theorems:
-            implication = '<%s⊃%s>' % (theorem, s)
-            if implication in self.theorems:
+        for theorem in self.theorems.antecedents_of(s):
+            if theorem in self.theorems:
                 return True  # because of the implication
         return False
 
     def _is_valid_by_substituting(self, s, a, b):
-        for xi in range(0, len(s)):
-            for xj in range(xi+1, len(s)):
-                x = s[xi:xj]
-                if wff.is_well_formed_formula(x):
-                    for yi in range(0, len(s)):
-                        for yj in range(yi+1, len(s)):
-                            y = s[yi:yj]
-                            if wff.is_well_formed_formula(y):
-                                first = a.replace('X', x).replace('Y', y)
-                                if len(first) > len(s):
-                                    continue
-                                second = b.replace('X', x).replace('Y', y)
-                                i = s.find(first)
-                                while i != -1:
-                                    substituted_s = s[:i] + second + s[i+len(first):]
-                                    if substituted_s in self.theorems:
-                                        return True
-                                    i = s.find(first, i+1)
+        f = wff.parse(s)
+        if not isinstance(f, Formula):
+            return False
+        a, b = _template(a), _template(b)
+        def rewrite(x):
+            bindings = a.match(x)
+            return None if bindings is None else b.build(bindings)
+        for substituted_s in rewrites_of_one_subformula(f, rewrite):
+            if self.theorems.contains_formula(substituted_s):
+                return True
         return False
 
     def _is_valid_by_interchanging(self, s, a, b):
@@ -125,14 +149,21 @@ class Derivation:
         return (b == a.replace(u, replacement))
 
     def is_valid_by_specification(self, s):
-        for theorem in self.theorems:
-            if theorem.startswith('∀'):
-                colon = theorem.find(':')
-                if colon >= 0:
-                    u, x = theorem[1:colon], theorem[colon+1:]
-                    assert is_variable(u)
-                    if self._is_substitution_of_some_term_for_variable(u, x, s):
-                        return True
+        # Several leading quantifiers can be specified at once, as long as
+        # doing it one at a time would be valid: each term can't contain a
+        # variable that's still quantified when it's put in.
+        f = wff.parse(s)
+        if isinstance(f, Formula):
+            for us, x, terms in self.theorems.universals_generalizing(f):
+                if not any(terms[u].free_variables & (x.quantified_variables | set(us[i+1:]))
+                           for i, u in enumerate(us)):
+                    return True
+        # The tree only holds what parses; the string check covers the rest.
+        if not isinstance(f, Formula) or self.theorems.has_malformed():
+            for u, x in self.theorems.universals_with_body_shaped_like(s):
+                assert is_variable(u)
+                if self._is_substitution_of_some_term_for_variable(u, x, s):
+                    return True
         return False
 
     def is_valid_by_generalization(self, s):
@@ -148,27 +179,26 @@ class Derivation:
         return False
 
     def is_valid_by_interchange(self, s):
-        for theorem in self.theorems:
-            if len(theorem) == len(s):
-                a = theorem.find('∀')
-                while a >= 0 and s[:a] == theorem[:a]:
-                    if s[a:a+2] == '~∃':
-                        colon = theorem.find(':', a+1)
-                        u = theorem[a+1:colon]
-                        assert is_variable(u)
-                        if theorem[colon+1] == '~':
-                            if s == theorem[:a] + '~∃' + u + ':' + theorem[colon+2:]:
-                                return True
-                    a = theorem.find('∀', a+1)
-                ne = theorem.find('~∃')
-                while ne >= 0 and s[:ne] == theorem[:ne]:
-                    if s[ne] == '∀':
-                        colon = theorem.find(':', ne+2)
-                        u = theorem[ne+2:colon]
-                        assert is_variable(u)
-                        if s == theorem[:ne] + '∀' + u + ':~' + theorem[colon+1:]:
+        for theorem in self.theorems.theorems_of_length(len(s)):
+            a = theorem.find('∀')
+            while a >= 0 and s[:a] == theorem[:a]:
+                if s[a:a+2] == '~∃':
+                    colon = theorem.find(':', a+1)
+                    u = theorem[a+1:colon]
+                    assert is_variable(u)
+                    if theorem[colon+1] == '~':
+                        if s == theorem[:a] + '~∃' + u + ':' + theorem[colon+2:]:
                             return True
-                    ne = theorem.find('~∃', ne+2)
+                a = theorem.find('∀', a+1)
+            ne = theorem.find('~∃')
+            while ne >= 0 and s[:ne] == theorem[:ne]:
+                if s[ne] == '∀':
+                    colon = theorem.find(':', ne+2)
+                    u = theorem[ne+2:colon]
+                    assert is_variable(u)
+                    if s == theorem[:ne] + '∀' + u + ':~' + theorem[colon+1:]:
+                        return True
+                ne = theorem.find('~∃', ne+2)
         return False
 
     def is_valid_by_existence(self, s):
@@ -177,7 +207,7 @@ class Derivation:
             if colon >= 0:
                 u, x = s[1:colon], s[colon+1:]
                 if is_variable(u) and u in wff.get_free_variables(x):
-                    for theorem in self.theorems:
+                    for theorem in self.theorems.theorems_shaped_like(x):
                         if self._is_substitution_of_some_term_for_variable(u, x, theorem):
                             return True
         return False
@@ -190,26 +220,22 @@ class Derivation:
                 symmetrical_s = '%s=%s' % (second, first)
                 if symmetrical_s in self.theorems:
                     return True
-            for theorem in self.theorems:
-                if theorem.startswith(first + '='):
-                    middle = theorem[len(first)+1:]
-                    transitive_s = '%s=%s' % (middle, second)
-                    if transitive_s in self.theorems:
-                        return True
+            for middle in self.theorems.equalities_with_left(first):
+                transitive_s = '%s=%s' % (middle, second)
+                if transitive_s in self.theorems:
+                    return True
         return False
 
     def is_valid_by_successorship(self, s):
-        equals = s.find('=')
-        if equals > 0:
-            first, second = s[:equals], s[equals+1:]
-            if is_term(first) and is_term(second):
-                add_s = 'S%s=S%s' % (first, second)
-                if add_s in self.theorems:
+        # On parsed terms, adding or dropping an S is O(1) however long
+        # the run of S's is.
+        f = wff.parse(s)
+        if isinstance(f, Atom):
+            if self.theorems.contains_formula(Atom(successors(1, f.left), successors(1, f.right))):
+                return True
+            if f.left.symbol == 'S' and f.right.symbol == 'S':
+                if self.theorems.contains_formula(Atom(f.left.operands[0], f.right.operands[0])):
                     return True
-                if first[0] == 'S' and second[0] == 'S':
-                    drop_s = '%s=%s' % (first[1:], second[1:])
-                    if drop_s in self.theorems:
-                        return True
         return False
 
     def is_valid_by_induction(self, s):
@@ -225,44 +251,205 @@ class Derivation:
                     return True
         return False
 
+    rules = [
+        'joining', 'separation', 'double_tilde', 'detachment', 'contrapositive',
+        'de_morgans', 'switcheroo', 'specification', 'generalization', 'interchange',
+        'existence', 'equality', 'successorship', 'induction',
+    ]
+
+    # The rules that can produce a well-formed formula of each top-level
+    # shape, given a bag of well-formed formulas. Each list is ordered by
+    # the cost of the rule's check divided by how often it succeeded,
+    # measured over replays of derivation_examples.py; rules that never
+    # succeeded come last, cheapest first.
+    rules_by_shape = {
+        '=': ['specification', 'equality', 'detachment', 'successorship', 'separation', 'double_tilde'],
+        '~': ['detachment', 'separation', 'double_tilde', 'specification', 'de_morgans',
+              'interchange', 'equality', 'contrapositive', 'switcheroo'],
+        '∀': ['specification', 'generalization', 'induction', 'detachment', 'separation', 'double_tilde',
+              'interchange', 'equality', 'de_morgans', 'switcheroo', 'contrapositive'],
+        '∃': ['existence', 'detachment', 'separation', 'double_tilde', 'interchange', 'specification',
+              'equality', 'de_morgans', 'switcheroo', 'contrapositive'],
+        '∧': ['joining', 'detachment', 'separation', 'double_tilde', 'interchange', 'specification',
+              'de_morgans', 'switcheroo', 'contrapositive'],
+        '∨': ['switcheroo', 'detachment', 'separation', 'double_tilde', 'interchange', 'specification',
+              'de_morgans', 'contrapositive'],
+        '⊃': ['separation', 'interchange', 'contrapositive', 'double_tilde', 'detachment', 'specification',
+              'de_morgans', 'switcheroo'],
+    }
+
+    def candidate_rules(self, s):
+        # The rules that could possibly justify s, in the order to try them.
+        f = wff.parse(s)
+        if not isinstance(f, Formula) or self.theorems.has_malformed():
+            return self.rules
+        return [rule for rule in self.rules_by_shape[_top_level_shape(f)]
+                if rule not in _requirements or _requirements[rule](s)]
+
+    def justify(self, s):
+        # The rule by which s follows from the bag ('carry_over' if it's there), or None.
+        s = str(s)
+        if s in self.theorems:
+            return 'carry_over'
+        for rule in self.candidate_rules(s):
+            if getattr(self, 'is_valid_by_' + rule)(s):
+                return rule
+        return None
+
+    def follows_by(self, s, rule, using=None):
+        # If using is given, only those premises (which must be in the bag) count.
+        s = str(s)
+        if rule != 'carry_over' and rule not in self.rules:
+            raise ValueError('unknown rule %r' % rule)
+        if using is None:
+            d = self
+        else:
+            premises = [str(p) for p in using]
+            if not all(p in self.theorems for p in premises):
+                return False
+            d = type(self).__new__(type(self))
+            d.premise, d.theorems = self.premise, TheoremStore(premises)
+        if rule == 'carry_over':
+            return s in d.theorems
+        return getattr(d, 'is_valid_by_' + rule)(s)
+
     def is_valid_new_theorem(self, s):
-        return (
-            (s in self.theorems) or
-            self.is_valid_by_joining(s) or
-            self.is_valid_by_separation(s) or
-            self.is_valid_by_double_tilde(s) or
-            self.is_valid_by_detachment(s) or
-            self.is_valid_by_contrapositive(s) or
-            self.is_valid_by_de_morgans(s) or
-            self.is_valid_by_switcheroo(s) or
-            self.is_valid_by_specification(s) or
-            self.is_valid_by_generalization(s) or
-            self.is_valid_by_interchange(s) or
-            self.is_valid_by_existence(s) or
-            self.is_valid_by_equality(s) or
-            self.is_valid_by_successorship(s) or
-            self.is_valid_by_induction(s) or
-            False
-        )
+        return self.justify(s) is not None
 
     def handwave(self):
         self.handwaving = True
 
-    def step(self, s):
-        if not (self.handwaving or self.is_valid_new_theorem(s)):
+    def step(self, s, rule=None, using=None):
+        # If rule is given, only that rule (and, with using, only those premises)
+        # is checked; otherwise every rule is tried.
+        s = str(s)
+        if self.handwaving:
+            rule = 'handwave'
+        elif self.model is not None and self.model.refutes(s):
+            rule = None
+        elif rule is None:
+            rule = self.justify(s)
+        elif not self.follows_by(s, rule, using):
+            rule = None
+        if rule is None:
             raise InvalidStep()
         self.handwaving = False
         self.theorems.add(s)
         self.conclusion = s
+        if self.journal is not None:
+            self.journal.record(step=s, rule=rule)
 
-    @contextlib.contextmanager
-    def fantasy(self, premise):
-        f = Derivation([premise, self.theorems.copy()])
-        yield f
+    def calculate(self, s):
+        # Adds the ground equation s along with the steps that lead to it.
+        try:
+            steps = arithmetic.chain(str(s))
+        except ValueError:
+            raise InvalidStep()
+        for x, rule in steps:
+            if x not in self.theorems:
+                self.step(x, rule=rule)
+
+    def begin_fantasy(self, premise):
+        assert self.child is None
+        premise = str(premise)
+        self.child = type(self)([premise, self.theorems.child()])
+        if self.journal is not None:
+            self.child.journal = self.journal
+            self.journal.frames.append(self.child)
+            self.journal.record(fantasy=premise)
+        return self.child
+
+    def end_fantasy(self):
+        f = self._leave_fantasy()
         s = '<%s⊃%s>' % (f.premise, f.conclusion)
         self.theorems.add(s)
         self.conclusion = s
+        # Only now, so that a snapshot taken by this record includes s.
+        if self.journal is not None:
+            self.journal.record(end_fantasy=True)
+
+    def abandon_fantasy(self):
+        self._leave_fantasy()
+        if self.journal is not None:
+            self.journal.record(abandon_fantasy=True)
+
+    def _leave_fantasy(self):
+        f, self.child = self.child, None
+        if self.journal is not None:
+            self.journal.frames.pop()
+        return f
+
+    @contextlib.contextmanager
+    def fantasy(self, premise):
+        f = self.begin_fantasy(premise)
+        try:
+            yield f
+        except BaseException:
+            self.abandon_fantasy()
+            raise
+        self.end_fantasy()
+
+    def innermost(self):
+        d = self
+        while d.child is not None:
+            d = d.child
+        return d
+
+    def snapshot_state(self):
+        return {
+            'premise': self.premise,
+            'conclusion': self.conclusion,
+            'theorems': sorted(self.theorems.local_theorems()),
+        }
+
+    @classmethod
+    def resume(cls, path, snapshot_every=1000, model=None):
+        # Rebuilds the Derivation and its open fantasies from the journal at
+        # path. The journal doesn't say which model the steps were checked
+        # against, so pass it again if there was one.
+        frames, records, offset = journal.load(path)
+        d = cls(model=model)
+        if frames is not None:
+            d.theorems = TheoremStore(frames[0]['theorems'])
+            d.conclusion = frames[0]['conclusion']
+            parent = d
+            for frame in frames[1:]:
+                parent.child = cls([frame['premise'], TheoremStore(frame['theorems'], parent.theorems)])
+                parent.child.conclusion = frame['conclusion']
+                parent = parent.child
+        for record in records:
+            # These steps were checked when they were first taken.
+            f = d.innermost()
+            if 'step' in record:
+                f.theorems.add(record['step'])
+                f.conclusion = record['step']
+            elif 'fantasy' in record:
+                f.begin_fantasy(record['fantasy'])
+            else:
+                parent = d
+                while parent.child is not f:
+                    parent = parent.child
+                if 'end_fantasy' in record:
+                    parent.end_fantasy()
+                else:
+                    parent.abandon_fantasy()
+        d.journal = journal.Journal(path, snapshot_every, offset)
+        f = d
+        while f is not None:
+            f.journal = d.journal
+            d.journal.frames.append(f)
+            f = f.child
+        return d
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
 
     def print_all_theorems(self):
         for theorem in self.theorems:
             print(theorem)
+
+for _rule in Derivation.rules:
+    _method = 'is_valid_by_' + _rule
+    setattr(Derivation, _method, instrument.timed('Derivation.' + _method, hits=True)(getattr(Derivation, _method)))
@@ -1,6 +1,11 @@
 # -*- coding: utf-8 -*-
 
+import os
+import tempfile
+
 from derivation import Derivation, InvalidStep
+from model_check import ModelChecker
+from proof_search import ProofSearch, replay
 from wff_quick import is_well_formed_formula
 
 # Page 188:
@@ -56,6 +61,35 @@ d.step('(S0+0)=S0')
 d.step('S(S0+0)=SS0')
 d.step('(S0+S0)=SS0')
 
+# The same again, naming the rule (and premises) that justify each step.
+d = Derivation()
+d.step('∀b:(S0+Sb)=S(S0+b)', rule='specification', using=['∀a:∀b:(a+Sb)=S(a+b)'])
+d.step('(S0+S0)=S(S0+0)', rule='specification')
+d.step('(S0+0)=S0', rule='specification', using=['∀a:(a+0)=a'])
+d.step('S(S0+0)=SS0', rule='successorship', using=['(S0+0)=S0'])
+try:
+    d.step('(S0+S0)=SS0', rule='successorship')  # transitivity (Wrong rule!)
+    assert False
+except InvalidStep:
+    pass
+try:
+    d.step('(S0+S0)=SS0', rule='equality', using=['(S0+S0)=S(S0+0)', '(S0+0)=S0'])  # (Wrong premise!)
+    assert False
+except InvalidStep:
+    pass
+d.step('(S0+S0)=SS0', rule='equality', using=['(S0+S0)=S(S0+0)', 'S(S0+0)=SS0'])
+
+# Specification can strip several quantifiers at once.
+d = Derivation()
+d.step('(S0+S0)=S(S0+0)', rule='specification', using=['∀a:∀b:(a+Sb)=S(a+b)'])
+d.step('(S0⋅SS0)=((S0⋅S0)+S0)', rule='specification')
+try:
+    d.step('(b+S0)=S(b+0)', rule='specification')  # b would be captured by ∀b (Invalid!)
+    assert False
+except InvalidStep:
+    pass
+d.step('(S0+Sb)=S(S0+b)', rule='specification')
+
 # Page 219: 1 times 1 equals 1.
 d = Derivation()
 d.step('∀a:∀b:(a⋅Sb)=((a⋅b)+a)')
@@ -73,6 +107,26 @@ d.step('S((S0⋅0)+0)=S0')  # add S
 d.step('((S0⋅0)+S0)=S0')  # transitivity
 d.step('(S0⋅S0)=S0')  # transitivity
 
+# The same, done by arithmetic.chain.
+d = Derivation()
+d.calculate('(S0⋅S0)=S0')
+assert '((S0⋅0)+S0)=S0' in d.theorems
+d.calculate('(SS0⋅SS0)=(SSS0+S0)')
+try:
+    d.calculate('(S0+S0)=S0')  # (False!)
+    assert False
+except InvalidStep:
+    pass
+
+# A ModelChecker turns down false steps without trying any rules.
+d = Derivation(model=ModelChecker())
+d.calculate('(S0+S0)=SS0')
+try:
+    d.step('∀a:(a+S0)=a')  # (False, for a=0!)
+    assert False
+except InvalidStep:
+    pass
+
 # Page 220. Illegal Shortcuts.
 d = Derivation()
 d.step('∀a:(a+0)=a')  # axiom 2
@@ -131,6 +185,14 @@ d.step('∀b:(0+b)=b')              # induction
 d.step('(0+a)=a')                 # specialization
 d.step('∀a:(0+a)=a')              # generalization
 
+# The same two theorems, found by ProofSearch rather than by hand.
+for target in ['(S0+S0)=SS0', '(0+a)=a']:
+    records = ProofSearch(target, max_seconds=30).run()
+    assert records is not None
+    d = Derivation()
+    replay(records, d)
+    assert target in d.theorems
+
 # Of my own invention: <∃b:a=SSb⊃∃c:a=Sc>
 d = Derivation()
 with d.fantasy('∀c:~a=Sc') as f:
@@ -141,3 +203,40 @@ d.step('<~∃c:a=Sc⊃∀b:~a=SSb>')
 d.step('<~∃c:a=Sc⊃~∃b:a=SSb>')
 d.step('<~~∃b:a=SSb⊃~~∃c:a=Sc>')
 d.step('<∃b:a=SSb⊃∃c:a=Sc>')
+
+# Journaling: a derivation interrupted halfway through a fantasy can be
+# resumed from its log, and carries on as if nothing had happened.
+with tempfile.TemporaryDirectory() as tmp:
+    log = os.path.join(tmp, 'derivation.log')
+    d = Derivation(log=log, snapshot_every=2)
+    d.step('∀a:∀b:(a+Sb)=S(a+b)')
+    d.step('∀b:(0+Sb)=S(0+b)')
+    d.step('(0+Sb)=S(0+b)')
+    f = d.begin_fantasy('(0+b)=b')
+    f.step('S(0+b)=Sb')
+    d.close()  # ...and then the process dies.
+    with open(log, 'ab') as torn:
+        torn.write(b'{"step": "(0+Sb)=S')
+    d = Derivation.resume(log)
+    f = d.innermost()
+    assert f.premise == '(0+b)=b' and f.conclusion == 'S(0+b)=Sb'
+    f.step('(0+Sb)=S(0+b)')
+    f.step('(0+Sb)=Sb')
+    d.end_fantasy()
+    d.step('∀b:<(0+b)=b⊃(0+Sb)=Sb>')
+    d.close()
+    d = Derivation.resume(log)
+    assert d.child is None and d.conclusion == '∀b:<(0+b)=b⊃(0+Sb)=Sb>'
+    assert '<(0+b)=b⊃(0+Sb)=Sb>' in d.theorems
+    d.step('(0+0)=0')
+    d.step('∀b:(0+b)=b')
+    d.close()
+
+    # A snapshot taken by the record that ends a fantasy includes what it proved.
+    d = Derivation(log=log, snapshot_every=3, model=ModelChecker())
+    with d.fantasy('a=0') as f:
+        f.step('a=0')
+    d.close()
+    d = Derivation.resume(log, model=ModelChecker())
+    assert '<a=0⊃a=0>' in d.theorems and d.conclusion == '<a=0⊃a=0>' and d.model is not None
+    d.close()
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+
+import weakref
+
+from wff import FormulaInfo
+
+# Every node is interned: constructing a node that is structurally equal
+# to a live node returns the very same object. So two nodes are equal
+# exactly when they are identical, and `==`, `in` and dictionary lookups
+# cost a pointer comparison plus a precomputed hash.
+_interned = weakref.WeakValueDictionary()
+
+class Node(object):
+    __slots__ = ('free_variables', 'quantified_variables', '_hash', '_text', '__weakref__')
+
+    def __new__(cls, *args):
+        key = (cls,) + args
+        node = _interned.get(key)
+        if node is None:
+            node = object.__new__(cls)
+            node._setup(*args)
+            node._hash = hash(key)
+            node._text = None
+            _interned[key] = node
+        return node
+
+    def __hash__(self):
+        return self._hash
+
+    def __reduce__(self):
+        return (type(self), self.args())
+
+    def __str__(self):
+        if self._text is None:
+            self._text = ''.join(self.pieces())
+        return self._text
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, str(self))
+
+    def pieces(self):
+        # Walk the tree iteratively, so that deeply nested formulas
+        # don't run into Python's recursion limit. Only the node being
+        # serialized caches its text; the subtrees don't, so that
+        # serializing a formula costs O(n) memory rather than O(n*depth).
+        stack = [self]
+        while stack:
+            x = stack.pop()
+            if isinstance(x, str):
+                yield x
+            elif x._text is not None:
+                yield x._text
+            else:
+                stack.extend(reversed(x.parts()))
+
+    def info(self):
+        return FormulaInfo(isinstance(self, Formula), set(self.free_variables), set(self.quantified_variables), self)
+
+class Term(Node):
+    __slots__ = ('symbol', 'operands')
+
+    def __new__(cls, symbol, *operands):
+        # Term('0') and Term('S', t) still work, but give the compact
+        # forms below, so that every term has just one representation.
+        if cls is Term:
+            if symbol == '0':
+                return Numeral(0)
+            if symbol == 'S':
+                return successors(1, *operands)
+        return Node.__new__(cls, symbol, *operands)
+
+    def _setup(self, symbol, *operands):
+        self.symbol = symbol
+        self.operands = operands
+        if symbol == '0':
+            self.free_variables = frozenset()
+        elif operands:
+            self.free_variables = frozenset().union(*[t.free_variables for t in operands])
+        else:
+            self.free_variables = frozenset([symbol])
+        self.quantified_variables = frozenset()
+
+    def args(self):
+        return (self.symbol,) + self.operands
+
+    def parts(self):
+        if self.symbol == 'S':
+            return ('S', self.operands[0])
+        elif self.operands:
+            return ('(', self.operands[0], self.symbol, self.operands[1], ')')
+        return (self.symbol,)
+
+    def is_variable(self):
+        return not self.operands and self.symbol != '0'
+
+class Numeral(Term):
+    # S...S0 with n S's, stored as n.
+    __slots__ = ('n',)
+
+    def _setup(self, n):
+        self.n = n
+        self.symbol = 'S' if n else '0'
+        self.free_variables = self.quantified_variables = frozenset()
+
+    def args(self):
+        return (self.n,)
+
+    @property
+    def operands(self):
+        return (Numeral(self.n - 1),) if self.n else ()
+
+    def parts(self):
+        return ('S' * self.n + '0',)
+
+class Successor(Term):
+    # S...St with k S's, where t is a variable, a sum or a product.
+    __slots__ = ('k', 'base')
+
+    def _setup(self, k, base):
+        self.k, self.base = k, base
+        self.symbol = 'S'
+        self.free_variables = base.free_variables
+        self.quantified_variables = frozenset()
+
+    def args(self):
+        return (self.k, self.base)
+
+    @property
+    def operands(self):
+        return (successors(self.k - 1, self.base),)
+
+    def parts(self):
+        return ('S' * self.k, self.base)
+
+class Formula(Node):
+    __slots__ = ()
+
+class Atom(Formula):
+    __slots__ = ('left', 'right')
+
+    def _setup(self, left, right):
+        self.left, self.right = left, right
+        self.free_variables = left.free_variables | right.free_variables
+        self.quantified_variables = frozenset()
+
+    def args(self):
+        return (self.left, self.right)
+
+    def parts(self):
+        return (self.left, '=', self.right)
+
+class Not(Formula):
+    __slots__ = ('body',)
+
+    def _setup(self, body):
+        self.body = body
+        self.free_variables = body.free_variables
+        self.quantified_variables = body.quantified_variables
+
+    def args(self):
+        return (self.body,)
+
+    def parts(self):
+        return ('~', self.body)
+
+    def with_child(self, slot, x):
+        return Not(x)
+
+class Compound(Formula):
+    __slots__ = ('left', 'op', 'right')
+
+    def _setup(self, left, op, right):
+        self.left, self.op, self.right = left, op, right
+        self.free_variables = left.free_variables | right.free_variables
+        self.quantified_variables = left.quantified_variables | right.quantified_variables
+        assert not (self.free_variables & self.quantified_variables)
+
+    def args(self):
+        return (self.left, self.op, self.right)
+
+    def parts(self):
+        return ('<', self.left, self.op, self.right, '>')
+
+    def with_child(self, slot, x):
+        if slot == 'left':
+            return Compound(x, self.op, self.right)
+        return Compound(self.left, self.op, x)
+
+class Quantified(Formula):
+    __slots__ = ('quantifier', 'variable', 'body')
+
+    def _setup(self, quantifier, variable, body):
+        self.quantifier, self.variable, self.body = quantifier, variable, body
+        assert variable in body.free_variables
+        self.free_variables = body.free_variables - set([variable])
+        self.quantified_variables = body.quantified_variables | set([variable])
+
+    def args(self):
+        return (self.quantifier, self.variable, self.body)
+
+    def parts(self):
+        return (self.quantifier, self.variable, ':', self.body)
+
+    def with_child(self, slot, x):
+        return Quantified(self.quantifier, self.variable, x)
+
+def successors(n, t):
+    # S...St with n S's, in O(1): runs of S's merge.
+    if n == 0:
+        return t
+    if isinstance(t, Numeral):
+        return Numeral(t.n + n)
+    if isinstance(t, Successor):
+        return Successor(t.k + n, t.base)
+    return Successor(n, t)
+
+def numeral(n):
+    return Numeral(n)
+
+def substitute(node, u, t):
+    # Puts t in place of every free u in node. The caller makes sure
+    # that t's variables don't get captured.
+    if u not in node.free_variables:
+        return node
+    if isinstance(node, Successor):
+        return successors(node.k, substitute(node.base, u, t))
+    elif isinstance(node, Term):
+        if not node.operands:
+            return t
+        return Term(node.symbol, *[substitute(x, u, t) for x in node.operands])
+    elif isinstance(node, Atom):
+        return Atom(substitute(node.left, u, t), substitute(node.right, u, t))
+    elif isinstance(node, Not):
+        return Not(substitute(node.body, u, t))
+    elif isinstance(node, Compound):
+        return Compound(substitute(node.left, u, t), node.op, substitute(node.right, u, t))
+    return Quantified(node.quantifier, node.variable, substitute(node.body, u, t))
+
+class Template:
+    # A schema such as '<X⊃Y>', whose capital letters stand for any formula.
+    def __init__(self, text):
+        self.text = text
+        self.pattern = self._compile(text)
+
+    def _compile(self, t):
+        if t in 'XY':
+            return t
+        if t[0] == '~':
+            return ('~', self._compile(t[1:]))
+        assert t[0] == '<' and t[-1] == '>'
+        depth = 0
+        for i in range(1, len(t)-1):
+            if t[i] == '<':
+                depth += 1
+            elif t[i] == '>':
+                depth -= 1
+            elif depth == 0 and t[i] in '∧∨⊃':
+                return ('<', self._compile(t[1:i]), t[i], self._compile(t[i+1:-1]))
+        assert False
+
+    def match(self, node, pattern=None, bindings=None):
+        if pattern is None:
+            pattern, bindings = self.pattern, {}
+        if isinstance(pattern, str):
+            if bindings.setdefault(pattern, node) is not node:
+                return None
+        elif pattern[0] == '~':
+            if not isinstance(node, Not):
+                return None
+            return self.match(node.body, pattern[1], bindings)
+        else:
+            if not isinstance(node, Compound) or node.op != pattern[2]:
+                return None
+            if self.match(node.left, pattern[1], bindings) is None:
+                return None
+            return self.match(node.right, pattern[3], bindings)
+        return bindings
+
+    def build(self, bindings, pattern=None):
+        if pattern is None:
+            pattern = self.pattern
+        if isinstance(pattern, str):
+            return bindings[pattern]
+        elif pattern[0] == '~':
+            return Not(self.build(bindings, pattern[1]))
+        return Compound(self.build(bindings, pattern[1]), pattern[2], self.build(bindings, pattern[3]))
+
+def rewrites_of_one_subformula(root, rewrite):
+    # Each formula obtained from root by replacing one subformula x
+    # (maybe root itself) by rewrite(x), where that isn't None.
+    # Each stack entry is (node, path), where path is (parent_path, parent, slot)
+    # for the slot of parent that node occupies, or None for the root.
+    stack = [(root, None)]
+    while stack:
+        node, path = stack.pop()
+        replacement = rewrite(node)
+        if replacement is not None:
+            up = path
+            while up is not None:
+                up, parent, slot = up
+                replacement = parent.with_child(slot, replacement)
+            yield replacement
+        if isinstance(node, (Not, Quantified)):
+            stack.append((node.body, (path, node, 'body')))
+        elif isinstance(node, Compound):
+            stack.append((node.right, (path, node, 'right')))
+            stack.append((node.left, (path, node, 'left')))
+
+assert Term('S', Term('0')) is numeral(1)
+assert Term('S', successors(2, Term('a'))) is Successor(3, Term('a')) and successors(10**6, numeral(10**6)).n == 2 * 10**6
+assert numeral(3).operands == (numeral(2),) and successors(2, Term('a')).operands[0] is Term('S', Term('a'))
+assert str(Compound(Atom(numeral(2), Term('a′')), '⊃', Not(Atom(Term('+', Term('a′'), numeral(0)), numeral(1))))) == '<SS0=a′⊃~(a′+0)=S0>'
+assert Quantified('∀', 'a', Atom(Term('a'), Term('a'))).free_variables == frozenset()
+assert Quantified('∀', 'a', Atom(Term('a'), Term('b'))).quantified_variables == frozenset(['a'])
+
+_x, _y = Atom(Term('a'), numeral(0)), Atom(Term('b'), numeral(1))
+assert Template('<~Y⊃~X>').match(Compound(Not(_y), '⊃', Not(_x))) == {'X': _x, 'Y': _y}
+assert Template('<X∨X>').match(Compound(_x, '∨', _y)) is None
+assert str(Template('~<X∨Y>').build({'X': _x, 'Y': _y})) == '~<a=0∨b=S0>'
+assert [str(f) for f in rewrites_of_one_subformula(Not(Not(_x)), lambda f: f.body if isinstance(f, Not) else None)] == ['~a=0', '~a=0']
+assert [str(f) for f in rewrites_of_one_subformula(Not(Not(Not(_x))), lambda f: f.body.body if isinstance(f, Not) and isinstance(f.body, Not) else None)] == ['~a=0', '~a=0']
+assert str(substitute(Quantified('∀', 'b', Atom(Term('+', Term('a'), Term('b')), Term('a′'))), 'a', numeral(1))) == '∀b:(S0+b)=a′'
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+
+import wff_quick
+from wff import FormulaInfo
+
+def _checker_version():
+    # Any change to the checker's source invalidates every cached result.
+    h = hashlib.sha1()
+    for module in ['wff', 'formula', 'wff_quick']:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), module + '.py'), 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+def digest(s):
+    return hashlib.blake2b(s.encode('utf-8'), digest_size=16).digest()
+
+class FormulaCache:
+    # FormulaInfos in sqlite, keyed by a digest of the text, with LRU
+    # eviction past max_entries. A new checker version empties it.
+    def __init__(self, path, max_entries=1000000):
+        self.db = sqlite3.connect(path)
+        self.max_entries = max_entries
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS formulas (digest BLOB PRIMARY KEY, wf INTEGER, fv TEXT, qv TEXT, used INTEGER)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS formulas_by_use ON formulas (used)')
+        version = _checker_version()
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row is None or row[0] != version:
+            self.db.execute('DELETE FROM formulas')
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (version,))
+        self.clock, self.count = self.db.execute('SELECT COALESCE(MAX(used), 0), COUNT(*) FROM formulas').fetchone()
+        self.hits = self.misses = 0
+        self.touched = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._flush()
+        self.db.commit()
+        self.db.close()
+
+    def _flush(self):
+        # Hits only note when they were used; the notes go out with the next
+        # write, so that a run that finds everything cached never writes.
+        if self.touched and self.db.in_transaction:
+            self.db.executemany('UPDATE formulas SET used = ? WHERE digest = ?', [(used, key) for key, used in self.touched.items()])
+            self.touched.clear()
+
+    def _tick(self):
+        self.clock += 1
+        return self.clock
+
+    def get(self, s):
+        key = digest(s)
+        row = self.db.execute('SELECT wf, fv, qv FROM formulas WHERE digest = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.touched[key] = self._tick()
+        return FormulaInfo(bool(row[0]), set(json.loads(row[1])), set(json.loads(row[2])))
+
+    def put(self, s, f):
+        self.db.execute(
+            'INSERT OR REPLACE INTO formulas VALUES (?, ?, ?, ?, ?)',
+            (digest(s), int(f.is_well_formed), json.dumps(sorted(f.free_variables)), json.dumps(sorted(f.quantified_variables)), self._tick())
+        )
+        self.count += 1
+        if self.count > self.max_entries:
+            self._flush()
+            self.count = self.db.execute('SELECT COUNT(*) FROM formulas').fetchone()[0]
+            excess = self.count - self.max_entries
+            if excess > 0:
+                self.db.execute('DELETE FROM formulas WHERE digest IN (SELECT digest FROM formulas ORDER BY used LIMIT ?)', (excess,))
+                self.count -= excess
+
+    def check_well_formed_formula(self, s):
+        f = self.get(s)
+        if f is None:
+            f = wff_quick.check_well_formed_formula(s)
+            self.put(s, f)
+        return f
+
+    def check_many(self, formulas, workers=1, chunksize=256):
+        # Like wff_quick.check_many, but only checks what isn't cached.
+        it = iter(formulas)
+        batches = iter(lambda: list(itertools.islice(it, 4 * chunksize * max(workers, 1))), [])
+        for batch in batches:
+            found = [self.get(s) for s in batch]
+            misses = [s for s, f in zip(batch, found) if f is None]
+            checked = iter(wff_quick.check_many(misses, workers, chunksize))
+            for s, f in zip(batch, found):
+                if f is None:
+                    f = next(checked)
+                    self.put(s, f)
+                yield f
+            self._flush()
+            self.db.commit()
+
+with FormulaCache(':memory:', max_entries=2) as _cache:
+    assert _cache.check_well_formed_formula('∀a:a=b').free_variables == set(['b'])
+    assert [f.is_well_formed for f in _cache.check_many(['0=0', '∀a:a=b', '0=='])] == [True, True, False]
+    assert (_cache.hits, _cache.misses, _cache.count) == (1, 3, 2)
+    assert _cache.get('∀a:a=b') is None
+
+wff_quick.use_cache(':memory:')
+assert wff_quick.is_well_formed_formula('∀a:a=b') and not wff_quick.is_well_formed_formula('0==')
+assert wff_quick.get_free_variables('(a+Sb)') == set(['a', 'b']) and wff_quick._cache.misses == 3
+wff_quick._cache.db.commit()
+wff_quick._cached.cache_clear()
+assert wff_quick.is_well_formed_formula('∀a:a=b') and not wff_quick._cache.db.in_transaction
+wff_quick.use_cache(None)
@@ -1,33 +1,232 @@
 # -*- coding: utf-8 -*-
 
+import collections
+import functools
+import re
+import string
+import sys
 import time
 
+import instrument
 import wff as wff_slow
 import wff_quick as wff
 import wff_quick as wff_quick
 from derivation import Derivation
 
+class Rope:
+    # A string made of fragments that are only joined when serialized.
+    __slots__ = ('parts', 'length')
+
+    def __init__(self, *parts):
+        self.parts = parts
+        self.length = sum(len(part) for part in parts)
+
+    def __len__(self):
+        return self.length
+
+    def __add__(self, other):
+        return Rope(self, other)
+
+    def __radd__(self, other):
+        return Rope(other, self)
+
+    def pieces(self):
+        # Iteratively, so that deeply nested ropes don't hit the recursion limit.
+        stack = [self]
+        while stack:
+            x = stack.pop()
+            if isinstance(x, str):
+                yield x
+            else:
+                stack.extend(reversed(x.parts))
+
+    def __str__(self):
+        return ''.join(self.pieces())
+
+    def __repr__(self):
+        return 'Rope(%r)' % str(self)
+
+    def write_to(self, fileobj):
+        for piece in self.pieces():
+            fileobj.write(piece)
+
+class EncodedFormula(Rope):
+    # A Rope that knows its free and quantified variables.
+    __slots__ = ('free_variables', 'quantified_variables')
+
+def variables(x):
+    # (free, quantified) of an EncodedFormula or a term string.
+    if isinstance(x, EncodedFormula):
+        return x.free_variables, x.quantified_variables
+    return frozenset(wff.get_free_variables_in_term(x)), frozenset()
+
+@functools.lru_cache()
+def _parse_template(template):
+    result = []
+    for literal, field, spec, conversion in string.Formatter().parse(template):
+        assert not any(c in wff.LOWERCASE for c in literal)
+        result.append((literal, field, literal.endswith(('∀', '∃'))))
+    return result
+
+def fmt(template, **fields):
+    # Like template.format, but refers to the fields instead of copying them.
+    # The template's quantifiers must all come first.
+    parts, free, quantified, bound = [], set(), set(), set()
+    for literal, field, binds in _parse_template(template):
+        if literal:
+            parts.append(literal)
+        if field is not None:
+            x = fields[field]
+            parts.append(x)
+            if binds:
+                bound.add(x)
+            else:
+                fv, qv = variables(x)
+                free |= fv
+                quantified |= qv
+    # Nothing may be both free and quantified, nor quantified twice over,
+    # anywhere inside; checking after binding would miss both.
+    assert bound <= free and not (free & quantified) and not (bound & quantified)
+    result = EncodedFormula(*parts)
+    result.free_variables = frozenset(free - bound)
+    result.quantified_variables = frozenset(quantified | bound)
+    return result
+
+assert str(fmt('<{x}∧{y}>', x=fmt('{a}=0', a='b'), y='0=0')) == '<b=0∧0=0>'
+assert len('∃a:' + fmt('{a}=0', a='a')) == 6
+assert variables(fmt('∃{r}:({a}+S{r})={b}', r='c', a='a′', b='S(b⋅0)')) == (frozenset(['a′', 'b']), frozenset(['c']))
+try:
+    fmt('∀{a}:<{x}∧{y}>', a='a', x=fmt('{a}=0', a='a'), y=fmt('∃{a}:{a}=0', a='a'))  # ∃a inside ∀a
+except AssertionError:
+    pass
+else:
+    assert False
+
+_variable = re.compile('[a-z]′*')
+
+def _shape(args):
+    # Return the args with their variables numbered in order of first
+    # appearance, and the variables in that order.
+    return _shape_of_texts(tuple(str(a) for a in args))
+
+@functools.lru_cache(maxsize=1 << 12)
+def _shape_of_texts(texts):
+    names = []
+    def number(m):
+        if m.group() not in names:
+            names.append(m.group())
+        return '#%d' % names.index(m.group())
+    return tuple(_variable.sub(number, t) for t in texts), tuple(names)
+
+# Fragments known to hold no variables, which renaming can skip.
+_no_variables = set()
+
+def _renamed_text(x, mapping):
+    if x in mapping:
+        return mapping[x]
+    if x in _no_variables:
+        return x
+    if _variable.search(x) is None:
+        if len(_no_variables) < 1 << 12:
+            _no_variables.add(x)
+        return x
+    return _variable.sub(lambda m: mapping.get(m.group(), m.group()), x)
+
+def _renamed(x, mapping, done):
+    # Return the rope x with its variables renamed by mapping, which holds
+    # only the variables that change. Whatever mentions none of them is
+    # shared with x rather than copied.
+    if x.__class__ is str:
+        return _renamed_text(x, mapping)
+    if isinstance(x, EncodedFormula) and mapping.keys().isdisjoint(x.free_variables) \
+            and mapping.keys().isdisjoint(x.quantified_variables):
+        return x
+    if id(x) not in done:
+        parts = []
+        for part in x.parts:
+            if part.__class__ is str:
+                if part in mapping:
+                    part = mapping[part]
+                elif part not in _no_variables:
+                    part = _renamed_text(part, mapping)
+            else:
+                part = _renamed(part, mapping, done)
+            parts.append(part)
+        if isinstance(x, EncodedFormula):
+            y = EncodedFormula(*parts)
+            y.free_variables = frozenset([mapping.get(v, v) for v in x.free_variables])
+            y.quantified_variables = frozenset([mapping.get(v, v) for v in x.quantified_variables])
+        else:
+            y = Rope(*parts)
+        done[id(x)] = y
+    return done[id(x)]
+
 def allocates_only_quantified_variables(memberfunc):
     def wrap(self, *args):
-        sr = self.save_r()
-        result = memberfunc(self, *args)
-        self.restore_r(sr)
-        fvs = [wff.get_free_variables(a) for a in args]
-        fvs = map(list, fvs)
-        fvs = set(sum(fvs, []))
-        assert wff.get_free_variables(result) == fvs
+        result = None
+        if self.memoize:
+            shape, names = _shape(args)
+            key = (memberfunc.__name__, shape)
+            if key in self.memo:
+                self.memo_stats[memberfunc.__name__][0] += 1
+                result = self._instantiate(self.memo[key], names, args)
+            else:
+                self.memo_stats[memberfunc.__name__][1] += 1
+        if result is None:
+            sr = self.save_r()
+            result = memberfunc(self, *args)
+            self.restore_r(sr)
+            if self.memoize:
+                bound = sorted(result.quantified_variables, key=lambda v: (len(v), self.alphabet.find(v[0])))
+                self.memo[key] = (result, names, bound)
+        fvs = set()
+        for a in args:
+            fvs |= variables(a)[0]
+        assert result.free_variables == fvs
+        if self.debug:
+            # Check the bookkeeping against the real thing.
+            assert wff.get_free_variables(str(result)) == result.free_variables
+            assert wff.get_quantified_variables(str(result)) == result.quantified_variables
         return result
-    return wrap
+    return instrument.timed('Encoder.' + memberfunc.__name__)(wrap)
 
 class Encoder:
-    def __init__(self):
+    # debug=True parses everything built, to check the bookkeeping.
+    # memoize=True renames what a method built for arguments of the same
+    # shape; the result is only alpha-equivalent to what it would build.
+    def __init__(self, debug=False, memoize=False):
         self.alphabet = 'abcdefghkmnopqrstuwxyz'
         self.exclude = set()
         self.r = None
+        self.debug = debug
+        self.memoize = memoize
+        self.memo = {}
+        self.memo_stats = collections.defaultdict(lambda: [0, 0])  # method -> [hits, misses]
+
+    def hit_rates(self):
+        # {method: (hits, misses, hit rate)}
+        return dict(
+            (name, (hits, misses, hits / (hits + misses)))
+            for name, (hits, misses) in self.memo_stats.items()
+        )
+
+    def _instantiate(self, entry, names, args):
+        template, template_names, bound = entry
+        mapping = dict(zip(template_names, names))
+        sr = self.save_r()
+        self.do_not_allocate_variables_in_terms(*args)
+        mapping.update((v, self.reg()) for v in bound)
+        self.restore_r(sr)
+        # The renaming must be capture-free: one-to-one, and never turning a
+        # bound variable into one of the free ones.
+        assert len(set(mapping.values())) == len(mapping)
+        assert not set(mapping[v] for v in bound) & set(names)
+        changed = dict((v, w) for v, w in mapping.items() if v != w)
+        return _renamed(template, changed, {}) if changed else template
 
     def do_not_allocate_variables_in_terms(self, *exclude):
         for t in exclude:
-            self.exclude |= wff.get_free_variables_in_term(t)
+            self.exclude |= variables(t)[0]
 
     def reg(self, *exclude):
         if self.r is None:
@@ -51,14 +250,14 @@ class Encoder:
     def a_lessthan_b(self, a, b):
         self.do_not_allocate_variables_in_terms(a,b)
         r = self.reg()
-        return '∃{r}:({a}+S{r})={b}'.format(**locals())
+        return fmt('∃{r}:({a}+S{r})={b}', **locals())
 
     @allocates_only_quantified_variables
     def a_mod_b_equals_c(self, a, b, c):
         self.do_not_allocate_variables_in_terms(a,b,c)
         r = self.reg()
         c_lessthan_b = self.a_lessthan_b(c, b)
-        result = '∃{r}:<{a}=(({b}⋅{r})+{c})∧{c_lessthan_b}>'.format(**locals())
+        result = fmt('∃{r}:<{a}=(({b}⋅{r})+{c})∧{c_lessthan_b}>', **locals())
         return result
 
     @allocates_only_quantified_variables
@@ -70,20 +269,17 @@ class Encoder:
         #   ...
         # According to http://math.stackexchange.com/a/312915/121469,
         # any finite sequence can be represented in this way for at least one pair (a,b).
-        result = self.a_mod_b_equals_c(a, 'S({b}⋅S{k})'.format(**locals()), x)
-        assert wff.is_well_formed_formula(result)
+        result = self.a_mod_b_equals_c(a, fmt('S({b}⋅S{k})', **locals()), x)
+        assert not self.debug or wff.is_well_formed_formula(str(result))
         return result
 
     def all(self, *args):
         if len(args) == 1:
             return args[0]
-        fv, qv = set(), set()
-        for a in args:
-            assert wff.is_well_formed_formula(a)
-            fv |= wff.get_free_variables(a)
-            qv |= wff.get_quantified_variables(a)
-        assert not (qv & fv)
-        return '<%s∧%s>' % (args[0], self.all(*args[1:]))
+        if self.debug:
+            for a in args:
+                assert wff.is_well_formed_formula(str(a))
+        return fmt('<{x}∧{y}>', x=args[0], y=self.all(*args[1:]))
 
     @allocates_only_quantified_variables
     def a_raised_to_b_is_c(self, a, b, c):
@@ -92,10 +288,10 @@ class Encoder:
         first_term_is_1 = self.abs_kth_term_is_x(x, y, self.numeral(0), self.numeral(1))
         bth_term_is_c = self.abs_kth_term_is_x(x, y, b, c)
         kth_term_is_z = self.abs_kth_term_is_x(x, y, k, z)
-        k1th_term_is_az = self.abs_kth_term_is_x(x, y, 'S'+k, '({a}⋅{z})'.format(**locals()))
+        k1th_term_is_az = self.abs_kth_term_is_x(x, y, 'S'+k, fmt('({a}⋅{z})', **locals()))
         k_lessthan_b = self.a_lessthan_b(k, b)
-        inductive_case = '∀{k}:∀{z}:<<{k_lessthan_b}∧{kth_term_is_z}>⊃{k1th_term_is_az}>'.format(**locals())
-        return '∃%s:∃%s:%s' % (x, y, self.all(first_term_is_1, bth_term_is_c, inductive_case))
+        inductive_case = fmt('∀{k}:∀{z}:<<{k_lessthan_b}∧{kth_term_is_z}>⊃{k1th_term_is_az}>', **locals())
+        return fmt('∃{x}:∃{y}:{all}', x=x, y=y, all=self.all(first_term_is_1, bth_term_is_c, inductive_case))
 
 assert Encoder().numeral(0) == '0'
 assert Encoder().numeral(3) == 'SSS0'
@@ -119,8 +315,8 @@ class MIUEncoder(Encoder):
         self.do_not_allocate_variables_in_terms(s,t)
         m = self.reg()
         ten = self.numeral(10)
-        t_is_m1 = '∃{m}:{t}=(({ten}⋅{m})+S0)'.format(**locals())
-        s_is_m10 = '{s}=({ten}⋅{t})'.format(**locals())
+        t_is_m1 = fmt('∃{m}:{t}=(({ten}⋅{m})+S0)', **locals())
+        s_is_m10 = fmt('{s}=({ten}⋅{t})', **locals())
         return self.all(t_is_m1, s_is_m10)
 
     @allocates_only_quantified_variables
@@ -130,9 +326,9 @@ class MIUEncoder(Encoder):
         ten = self.numeral(10)
         p_is_ten_to_m = self.a_raised_to_b_is_c(self.numeral(10), m, p)
         n_lessthan_p = self.a_lessthan_b(n, p)
-        t_is_3n = '{t}=((SSS0⋅{p})+{n})'.format(**locals())
-        s_is_3nn = '{s}=(({p}⋅{t})+{n})'.format(**locals())
-        return '∃%s:∃%s:∃%s:%s' % (m, n, p, self.all(p_is_ten_to_m, n_lessthan_p, t_is_3n, s_is_3nn))
+        t_is_3n = fmt('{t}=((SSS0⋅{p})+{n})', **locals())
+        s_is_3nn = fmt('{s}=(({p}⋅{t})+{n})', **locals())
+        return fmt('∃{m}:∃{n}:∃{p}:{all}', m=m, n=n, p=p, all=self.all(p_is_ten_to_m, n_lessthan_p, t_is_3n, s_is_3nn))
 
     @allocates_only_quantified_variables
     def s_is_derivable_from_t_by_axiom_3(self, s, t):
@@ -143,9 +339,9 @@ class MIUEncoder(Encoder):
         n_lessthan_p = self.a_lessthan_b(n, p)
         q_is_ten_to_mplus3 = self.a_raised_to_b_is_c(self.numeral(10), 'SSS' + m, q)
         n111 = '((%s⋅S%s)+S0)' % (ten, ten)
-        t_is_k111n = '{t}=((({k}⋅{q})+({n111}⋅{p}))+{n})'.format(**locals())
-        s_is_kn = '{s}=((({ten}⋅{k})⋅{p})+{n})'.format(**locals())
-        return '∃%s:∃%s:∃%s:∃%s:∃%s:%s' % (k, m, n, p, q, self.all(
+        t_is_k111n = fmt('{t}=((({k}⋅{q})+({n111}⋅{p}))+{n})', **locals())
+        s_is_kn = fmt('{s}=((({ten}⋅{k})⋅{p})+{n})', **locals())
+        return fmt('∃{k}:∃{m}:∃{n}:∃{p}:∃{q}:{all}', k=k, m=m, n=n, p=p, q=q, all=self.all(
             p_is_ten_to_m, n_lessthan_p, q_is_ten_to_mplus3, t_is_k111n, s_is_kn
         ))
 
@@ -157,9 +353,9 @@ class MIUEncoder(Encoder):
         p_is_ten_to_m = self.a_raised_to_b_is_c(self.numeral(10), m, p)
         n_lessthan_p = self.a_lessthan_b(n, p)
         q_is_ten_to_mplus2 = self.a_raised_to_b_is_c(self.numeral(10), 'SS' + m, q)
-        t_is_k00n = '{t}=(({k}⋅{q})+{n})'.format(**locals())
-        s_is_kn = '{s}=(({k}⋅{p})+{n})'.format(**locals())
-        return '∃%s:∃%s:∃%s:∃%s:∃%s:%s' % (k, m, n, p, q, self.all(
+        t_is_k00n = fmt('{t}=(({k}⋅{q})+{n})', **locals())
+        s_is_kn = fmt('{s}=(({k}⋅{p})+{n})', **locals())
+        return fmt('∃{k}:∃{m}:∃{n}:∃{p}:∃{q}:{all}', k=k, m=m, n=n, p=p, q=q, all=self.all(
             p_is_ten_to_m, n_lessthan_p, q_is_ten_to_mplus2, t_is_k00n, s_is_kn
         ))
 
@@ -182,12 +378,12 @@ class MIUEncoder(Encoder):
         kth_term_is_p = self.abs_kth_term_is_x(x, y, k, p)
         k1th_term_is_q = self.abs_kth_term_is_x(x, y, 'S'+k, q)
         p_implies_q = self.s_is_directly_derivable_from_t(q, p)
-        inductive_case = '∀%s:∀%s:∀%s:<%s⊃%s>' % (k, p, q, self.all(
+        inductive_case = fmt('∀{k}:∀{p}:∀{q}:<{all}⊃{p_implies_q}>', k=k, p=p, q=q, all=self.all(
             k_lessthan_n,
             kth_term_is_p,
             k1th_term_is_q,
-        ), p_implies_q)
-        return '∃%s:∃%s:∃%s:%s' % (x,y,n, self.all(
+        ), p_implies_q=p_implies_q)
+        return fmt('∃{x}:∃{y}:∃{n}:{all}', x=x, y=y, n=n, all=self.all(
             first_term_is_t,
             nth_term_is_s,
             inductive_case,
@@ -197,24 +393,38 @@ class MIUEncoder(Encoder):
     def t_mod_3_is_0(self, t):
         self.do_not_allocate_variables_in_terms(t)
         x = self.reg()
-        return '∃{x}:(SSS0⋅{x})={t}'.format(**locals())
+        return fmt('∃{x}:(SSS0⋅{x})={t}', **locals())
 
     @allocates_only_quantified_variables
     def mumon(self):
         return self.s_is_derivable_from_t(self.numeral(self.godel_number('MU')), self.numeral(self.godel_number('MI')))
 
+# Building MUMON shouldn't need to parse anything.
+_parses = wff.parse.cache_info()
+_mumon = MIUEncoder().mumon()
+assert wff.parse.cache_info()[:2] == _parses[:2]
+assert str(_mumon) == str(MIUEncoder(debug=True).mumon())
+_e = MIUEncoder(memoize=True, debug=True)
+assert len(_e.mumon()) == 1912 and _e.hit_rates()['abs_kth_term_is_x'] == (8, 8, 0.5)
+# A hit shares the parts of what it built before that renaming leaves alone.
+_e, _product = Encoder(memoize=True), fmt('({x}⋅{y})', x='x', y='y')
+_e.a_lessthan_b('k', _product)
+assert _e.a_lessthan_b('n', fmt('({x}⋅{y})', x='x', y='y')).parts[-1] is _product
+
 if __name__ == '__main__':
-    assert wff.is_well_formed_formula(MIUEncoder().s_is_directly_derivable_from_t('s', 't'))
-    assert wff.is_well_formed_formula(MIUEncoder().s_is_derivable_from_t('s', 't'))
+    assert wff.is_well_formed_formula(str(MIUEncoder().s_is_directly_derivable_from_t('s', 't')))
+    assert wff.is_well_formed_formula(str(MIUEncoder().s_is_derivable_from_t('s', 't')))
 
-    b_is_a_power_of_10 = '∃c:' + Encoder().a_raised_to_b_is_c(Encoder().numeral(10), 'c', 'b')
+    b_is_a_power_of_10 = str('∃c:' + Encoder().a_raised_to_b_is_c(Encoder().numeral(10), 'c', 'b'))
     print('A TNT expression encoding the statement "b is a power of 10" is:')
     print(b_is_a_power_of_10)
     assert wff.is_well_formed_formula(b_is_a_power_of_10)
 
     print('Computing MUMON...')
     mumon = MIUEncoder().mumon()
-    print(mumon)
+    mumon.write_to(sys.stdout)
+    print()
+    mumon = str(mumon)
 
     e = MIUEncoder()
     print('Lemma 1 for proving MU underivable:')
@@ -230,8 +440,8 @@ if __name__ == '__main__':
     print('∀s:∀t:<<%s∧%s>⊃%s>' % (e.t_mod_3_is_0('t'), e.s_is_derivable_from_t_by_axiom_4('s', 't'), e.t_mod_3_is_0('s')))
 
     start = time.time()
-    assert wff_quick.is_well_formed_formula(mumon)
+    assert wff_quick.check_well_formed_formula(mumon).is_well_formed
     print('is_wff_quick took %s seconds' % (time.time() - start))
     start = time.time()
-    assert wff_slow.is_well_formed_formula(mumon)
-    print('is_wff took %s seconds' % (time.time() - start))
+    assert wff_slow.is_well_formed_formula(mumon, packrat=True)
+    print('is_wff (packrat) took %s seconds' % (time.time() - start))
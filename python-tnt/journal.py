@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+class Journal:
+    # A write-ahead log of a Derivation, one JSON record per line: step,
+    # fantasy, end_fantasy or abandon_fantasy. Every snapshot_every
+    # records, the state goes to path + '.snapshot' with the log offset.
+    def __init__(self, path, snapshot_every=1000, offset=None):
+        self.path = path
+        self.snapshot_path = path + '.snapshot'
+        self.snapshot_every = snapshot_every
+        self.since_snapshot = 0
+        self.frames = []  # the Derivation and its open fantasies, outermost first
+        if offset is None:
+            self.f = open(path, 'wb')
+            if os.path.exists(self.snapshot_path):
+                os.remove(self.snapshot_path)
+        else:
+            # Drop whatever came after the last complete record.
+            self.f = open(path, 'r+b')
+            self.f.truncate(offset)
+            self.f.seek(offset)
+
+    def record(self, **record):
+        self.f.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+        self.f.flush()
+        self.since_snapshot += 1
+        if self.since_snapshot >= self.snapshot_every:
+            self.snapshot()
+
+    def snapshot(self):
+        state = {
+            'offset': self.f.tell(),
+            'frames': [frame.snapshot_state() for frame in self.frames],
+        }
+        with open(self.snapshot_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.snapshot_path + '.tmp', self.snapshot_path)
+        self.since_snapshot = 0
+
+    def close(self):
+        self.f.close()
+
+def load(path):
+    # (frames of the latest snapshot or None, the records after it, the
+    # offset just past the last complete record)
+    frames, offset = None, 0
+    if os.path.exists(path + '.snapshot'):
+        with open(path + '.snapshot', encoding='utf-8') as f:
+            state = json.load(f)
+        frames, offset = state['frames'], state['offset']
+    records = []
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b'\n'):
+                break  # torn write at the time of the crash
+            records.append(json.loads(line.decode('utf-8')))
+            offset += len(line)
+    return frames, records, offset
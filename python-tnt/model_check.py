@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+import instrument
+import wff_quick
+from godelize_mu import Encoder, MIUEncoder
+from formula import Atom, Compound, Formula, Not, Numeral, Successor, Term, numeral
+
+# Above this, a term's values might not fit in an int64, so they're
+# computed with Python ints (in arrays of dtype object) instead.
+_INT64_LIMIT = 1 << 62
+
+def is_universal(f, positive=True):
+    # Is every quantifier effectively a ∀? Then being false over 0..N
+    # means being false.
+    if isinstance(f, Atom):
+        return True
+    elif isinstance(f, Not):
+        return is_universal(f.body, not positive)
+    elif isinstance(f, Compound):
+        return is_universal(f.left, positive if f.op != '⊃' else not positive) and is_universal(f.right, positive)
+    return (f.quantifier == '∀') == positive and is_universal(f.body, positive)
+
+class ModelChecker:
+    # Evaluates formulas with every variable ranging over 0..n, a truth
+    # table per subformula over the axes of its variables.
+    def __init__(self, n=4, max_cells=1 << 22):
+        self.n = n
+        self.max_cells = max_cells
+
+    def _setup(self, f):
+        variables = sorted(f.free_variables | f.quantified_variables)
+        if (self.n + 1) ** len(variables) > self.max_cells:
+            raise ValueError('too many assignments: %d variables' % len(variables))
+        self.axes = dict((v, i) for i, v in enumerate(variables))
+        self.tables = {}
+        self.values = {}
+
+    def _bound(self, t):
+        if isinstance(t, Numeral):
+            return t.n
+        elif isinstance(t, Successor):
+            return t.k + self._bound(t.base)
+        elif t.is_variable():
+            return self.n
+        left, right = [self._bound(x) for x in t.operands]
+        return left + right if t.symbol == '+' else left * right
+
+    def _value(self, t, dtype):
+        key = (t, dtype)
+        if key not in self.values:
+            if isinstance(t, Numeral):
+                value = np.array(t.n, dtype=dtype)
+            elif isinstance(t, Successor):
+                value = t.k + self._value(t.base, dtype)
+            elif t.is_variable():
+                shape = [1] * len(self.axes)
+                shape[self.axes[t.symbol]] = self.n + 1
+                value = np.arange(self.n + 1).astype(dtype).reshape(shape)
+            else:
+                left, right = [self._value(x, dtype) for x in t.operands]
+                value = left + right if t.symbol == '+' else left * right
+            self.values[key] = value
+        return self.values[key]
+
+    def _table(self, f):
+        table = self.tables.get(f)
+        if table is not None:
+            return table
+        if isinstance(f, Atom):
+            dtype = np.int64 if max(self._bound(f.left), self._bound(f.right)) < _INT64_LIMIT else object
+            table = np.asarray(self._value(f.left, dtype) == self._value(f.right, dtype), dtype=bool)
+        elif isinstance(f, Not):
+            table = ~self._table(f.body)
+        elif isinstance(f, Compound):
+            # The right side is only looked at if the left one doesn't
+            # settle the matter for every assignment.
+            left = self._table(f.left)
+            if f.op == '∧':
+                table = left if not left.any() else left & self._table(f.right)
+            elif f.op == '∨':
+                table = left if left.all() else left | self._table(f.right)
+            else:
+                table = ~left if not left.any() else ~left | self._table(f.right)
+        else:
+            body = self._table(f.body)
+            axis = self.axes[f.variable]
+            if f.quantifier == '∀':
+                table = body.all(axis=axis, keepdims=True)
+            else:
+                table = body.any(axis=axis, keepdims=True)
+        self.tables[f] = table
+        return table
+
+    def _formula(self, f):
+        if isinstance(f, str):
+            s, f = f, wff_quick.parse(f)
+            if not isinstance(f, Formula):
+                raise ValueError('not a well-formed formula: %r' % s)
+        return f
+
+    def truth_table(self, f, variables=None):
+        f = self._formula(f)
+        if variables is None:
+            variables = sorted(f.free_variables)
+        self._setup(f)
+        table = self._table(f)
+        shape = [self.n + 1 if v in f.free_variables else 1 for v in sorted(self.axes)]
+        table = np.broadcast_to(table, shape)
+        order = [self.axes[v] for v in variables]
+        rest = [i for i in range(len(shape)) if i not in order]
+        return table.transpose(order + rest).reshape([self.n + 1] * len(variables))
+
+    def counterexample(self, f):
+        # An assignment of 0..n to f's free variables that makes f false, or None.
+        f = self._formula(f)
+        variables = sorted(f.free_variables)
+        table = self.truth_table(f, variables)
+        if table.all():
+            return None
+        return dict(zip(variables, [int(i) for i in np.argwhere(~table)[0]]))
+
+    def holds(self, f):
+        return self.counterexample(f) is None
+
+    @instrument.timed('ModelChecker.refutes', hits=True)
+    def refutes(self, s):
+        # Only formulas for which is_universal holds can be refuted.
+        f = wff_quick.parse(str(s))
+        if not isinstance(f, Formula) or not is_universal(f):
+            return False
+        try:
+            return self.counterexample(f) is not None
+        except ValueError:
+            return False
+
+_m = ModelChecker(n=6)
+assert _m.holds('∀a:∀b:<(a+b)=(b+a)∧(a⋅Sb)=((a⋅b)+a)>') and not _m.holds('∀a:(a+a)=a')
+assert _m.counterexample('<~a=0⊃(a+b)=SSb>') == {'a': 1, 'b': 0}
+assert _m.refutes('∀a:~(a⋅a)=SSSS0') and not _m.refutes('∃a:(a⋅a)=SSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSSS0')
+assert _m.holds(Atom(Term('⋅', numeral(2**40), Term('a')), numeral(2**80))) is False and _m.holds(Atom(Term('⋅', numeral(2**40), numeral(2**40)), numeral(2**80)))
+
+# The encodings in godelize_mu mean what they say, at least up to 6.
+_m, _range = ModelChecker(n=6), np.arange(7)
+assert (_m.truth_table(str(Encoder().a_lessthan_b('a', 'b')), ['a', 'b']) == (_range[:, None] < _range)).all()
+assert list(_m.truth_table(str(MIUEncoder().t_mod_3_is_0('t')))) == list(_range % 3 == 0)
+_a, _b, _c = np.ix_(_range, _range, _range)
+assert (_m.truth_table(str(Encoder().a_mod_b_equals_c('a', 'b', 'c')), ['a', 'b', 'c']) == ((_b > 0) & (_c == _a % np.maximum(_b, 1)))).all()
@@ -0,0 +1,503 @@
+# -*- coding: utf-8 -*-
+
+import ctypes
+import hashlib
+import heapq
+import itertools
+import multiprocessing
+import time
+
+import wff_quick as wff
+from derivation import Derivation
+from theorem_store import TheoremStore
+from formula import Atom, Compound, Formula, Not, Quantified, Template, Term, rewrites_of_one_subformula, substitute
+
+# The rules that rewrite a subformula in place, as pairs of templates
+# that can be interchanged in either direction.
+_interchangeable = [
+    ('contrapositive', Template('<X⊃Y>'), Template('<~Y⊃~X>')),
+    ('de_morgans', Template('<~X∧~Y>'), Template('~<X∨Y>')),
+    ('switcheroo', Template('<X∨Y>'), Template('<~X⊃Y>')),
+]
+
+def _rewriter(a, b):
+    def rewrite(x):
+        bindings = a.match(x)
+        return None if bindings is None else b.build(bindings)
+    return rewrite
+
+def _remove_double_tilde(x):
+    return x.body.body if isinstance(x, Not) and isinstance(x.body, Not) else None
+
+def _add_double_tilde(x):
+    return Not(Not(x))
+
+def _interchange(x):
+    if isinstance(x, Quantified) and x.quantifier == '∀' and isinstance(x.body, Not):
+        return Not(Quantified('∃', x.variable, x.body.body))
+    if isinstance(x, Not) and isinstance(x.body, Quantified) and x.body.quantifier == '∃':
+        return Quantified('∀', x.body.variable, Not(x.body.body))
+    return None
+
+def _parts(node):
+    # Yield every subformula and subterm of node, node included.
+    stack = [node]
+    while stack:
+        x = stack.pop()
+        yield x
+        if isinstance(x, Term):
+            stack.extend(x.operands)
+        elif isinstance(x, (Atom, Compound)):
+            stack.extend([x.left, x.right])
+        else:
+            stack.append(x.body)
+
+def _bigrams(s):
+    return set(s[i:i+2] for i in range(len(s) - 1))
+
+def _overlay(d):
+    # A Derivation whose bag is an overlay on d's, to try things in
+    # without touching d.
+    o = Derivation()
+    o.premise, o.conclusion, o.theorems = d.premise, d.conclusion, d.theorems.child()
+    return o
+
+class _GiveUp(Exception):
+    pass
+
+class SharedSeenSet:
+    # Fingerprints of formulas in shared memory, one hash table and lock
+    # per shard. A full shard reports everything as new.
+    def __init__(self, shards=64, slots_per_shard=1 << 14):
+        self.shards = shards
+        self.tables = [multiprocessing.RawArray(ctypes.c_uint64, slots_per_shard) for i in range(shards)]
+        self.counts = multiprocessing.RawArray(ctypes.c_int64, shards)
+        self.locks = [multiprocessing.Lock() for i in range(shards)]
+
+    def _find(self, s):
+        h = int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'little') | 1
+        shard = h % self.shards
+        table = self.tables[shard]
+        i = (h // self.shards) % len(table)
+        while table[i] != 0 and table[i] != h:
+            i = (i + 1) % len(table)
+        return h, shard, i
+
+    def add(self, s):
+        # Returns whether s was new.
+        h, shard, i = self._find(s)
+        with self.locks[shard]:
+            h, shard, i = self._find(s)
+            table = self.tables[shard]
+            if table[i] == h:
+                return False
+            if 4 * self.counts[shard] < 3 * len(table):
+                table[i] = h
+                self.counts[shard] += 1
+            return True
+
+    def __contains__(self, s):
+        h, shard, i = self._find(s)
+        return self.tables[shard][i] == h
+
+    def __len__(self):
+        return sum(self.counts)
+
+    def clear(self):
+        for table in self.tables:
+            ctypes.memset(ctypes.addressof(table), 0, ctypes.sizeof(table))
+        ctypes.memset(ctypes.addressof(self.counts), 0, ctypes.sizeof(self.counts))
+
+def _worker(inbox, outbox, seen):
+    # Expand the theorems we're sent against a replica of the bag, which
+    # the coordinator keeps up to date by sending along what's new.
+    for message in iter(inbox.get, None):
+        if message[0] == 'reset':
+            premise, theorems, pool, limit, max_depth = message[1:]
+            d = Derivation()
+            d.premise, d.theorems = premise, TheoremStore(theorems)
+            continue
+        delta, batch = message[1:]
+        for s in delta:
+            d.theorems.add(s)
+        results, checked = [], 0
+        for depth, s in batch:
+            if depth >= max_depth:
+                continue
+            for t, rule, premises in _consequences(d, wff.parse(s), pool):
+                t = str(t)
+                if len(t) > limit or t in d.theorems or t in seen or not wff.is_well_formed_formula(t):
+                    continue
+                checked += 1
+                if d.follows_by(t, rule, premises) and seen.add(t):
+                    results.append((t, rule, premises))
+        outbox.put((results, checked))
+
+class _Workers:
+    def __init__(self, n):
+        self.seen = SharedSeenSet()
+        self.outbox = multiprocessing.Queue()
+        self.inboxes = [multiprocessing.Queue() for i in range(n)]
+        self.processes = [
+            multiprocessing.Process(target=_worker, args=(inbox, self.outbox, self.seen), daemon=True)
+            for inbox in self.inboxes
+        ]
+        for process in self.processes:
+            process.start()
+
+    def reset(self, d, pool, limit, max_depth):
+        theorems = list(d.theorems)
+        self.seen.clear()
+        for s in theorems:
+            self.seen.add(s)
+        for inbox in self.inboxes:
+            inbox.put(('reset', d.premise, theorems, pool, limit, max_depth))
+
+    def expand(self, delta, batch):
+        # (every (t, rule, premises) found from batch, how many were checked)
+        n = len(self.inboxes)
+        for i, inbox in enumerate(self.inboxes):
+            inbox.put(('expand', delta, batch[i::n]))
+        results, checked = [], 0
+        for i in range(n):
+            r, c = self.outbox.get()
+            results.extend(r)
+            checked += c
+        return results, checked
+
+    def close(self):
+        for inbox in self.inboxes:
+            inbox.put(None)
+        for process in self.processes:
+            process.join()
+
+class ProofSearch:
+    # Breaks the goal down the way Hofstadter would (fantasies,
+    # contrapositives, induction, ...), and finds the rest by forward
+    # chaining, best-looking first. Every step goes through follows_by.
+    def __init__(self, target, derivation=None, max_depth=4, max_nodes=2000, max_seconds=10.0, max_goal_depth=6, workers=1):
+        self.target = str(target)
+        self.workers = workers
+        self.derivation = derivation if derivation is not None else Derivation()
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes
+        self.max_seconds = max_seconds
+        self.max_goal_depth = max_goal_depth
+        self.records = None
+        self.stats = {
+            'expanded': 0,      # theorems taken off the queue
+            'checked': 0,       # candidate steps checked against a rule
+            'derived': 0,       # candidate steps that passed
+            'frontier': 0,      # size of the queue when forward chaining last stopped
+            'max_frontier': 0,
+            'seconds': 0.0,
+        }
+
+    def rate(self):
+        # Candidate steps checked per second.
+        return self.stats['checked'] / max(self.stats['seconds'], 1e-9)
+
+    def run(self):
+        # The derivation as Journal-style records, or None if none was found in time.
+        start = time.time()
+        self.deadline = start + self.max_seconds
+        self.records = []
+        self._pool = _Workers(self.workers) if self.workers > 1 else None
+        try:
+            found = self._prove(_overlay(self.derivation), self.target, frozenset())
+        finally:
+            if self._pool is not None:
+                self._pool.close()
+            self.stats['seconds'] += time.time() - start
+        self.records = _without_abandoned_fantasies(self.records) if found else None
+        return self.records
+
+    def _step(self, frame, s, rule, using=None):
+        frame.step(s, rule=rule, using=using)
+        record = {'step': s, 'rule': rule}
+        if using is not None:
+            record['using'] = list(using)
+        self.records.append(record)
+
+    def _try(self, frame, s, rule):
+        if frame.follows_by(s, rule):
+            self._step(frame, s, rule)
+            return True
+        return False
+
+    def _prove(self, frame, goal, path):
+        # Make goal a theorem of frame, recording the steps taken.
+        if goal in frame.theorems:
+            return True
+        rule = frame.justify(goal)
+        if rule is not None:
+            self._step(frame, goal, rule)
+            return True
+        f = wff.parse(goal)
+        if not isinstance(f, Formula) or goal in path or len(path) >= self.max_goal_depth:
+            return False
+        if time.time() > self.deadline:
+            return False
+        path = path | set([goal])
+        if isinstance(f, Compound) and f.op == '⊃':
+            if self._prove_by_fantasy(frame, f, path):
+                return True
+            if self._prove_by_rewriting(frame, f, Compound(Not(f.right), '⊃', Not(f.left)), 'contrapositive', path):
+                return True
+        elif isinstance(f, Compound) and f.op == '∨':
+            if self._prove_by_rewriting(frame, f, Compound(Not(f.left), '⊃', f.right), 'switcheroo', path):
+                return True
+        elif isinstance(f, Compound) and f.op == '∧':
+            if self._prove(frame, str(f.left), path) and self._prove(frame, str(f.right), path):
+                return self._try(frame, goal, 'joining')
+        elif isinstance(f, Quantified) and f.quantifier == '∀':
+            if self._prove_by_generalization(frame, f, path) or self._prove_by_induction(frame, f, path):
+                return True
+        if self._forward_chain(frame, goal):
+            return True
+        return self._prove_by_specification(frame, f, path)
+
+    def _prove_by_fantasy(self, frame, f, path):
+        premise, conclusion = str(f.left), str(f.right)
+        try:
+            with frame.fantasy(premise) as g:
+                self.records.append({'fantasy': premise})
+                if not self._prove(g, conclusion, path):
+                    raise _GiveUp()
+                if g.conclusion != conclusion:
+                    self._step(g, conclusion, 'carry_over')
+        except _GiveUp:
+            self.records.append({'abandon_fantasy': True})
+            return False
+        self.records.append({'end_fantasy': True})
+        return True
+
+    def _prove_by_rewriting(self, frame, f, g, rule, path):
+        return self._prove(frame, str(g), path) and self._try(frame, str(f), rule)
+
+    def _can_generalize(self, frame, u):
+        return frame.premise is None or u not in wff.get_free_variables(frame.premise)
+
+    def _prove_by_generalization(self, frame, f, path):
+        if not self._can_generalize(frame, f.variable):
+            return False
+        return self._prove(frame, str(f.body), path) and self._try(frame, str(f), 'generalization')
+
+    def _prove_by_induction(self, frame, f, path):
+        u, x = f.variable, f.body
+        base = str(substitute(x, u, Term('0')))
+        step = str(Quantified('∀', u, Compound(x, '⊃', substitute(x, u, Term('S', Term(u))))))
+        return self._prove(frame, base, path) and self._prove(frame, step, path) and self._try(frame, str(f), 'induction')
+
+    def _prove_by_specification(self, frame, f, path):
+        for u in sorted(f.free_variables):
+            if self._can_generalize(frame, u):
+                if self._prove(frame, str(Quantified('∀', u, f)), path) and self._try(frame, str(f), 'specification'):
+                    return True
+        return False
+
+    def _forward_chain(self, frame, goal):
+        scratch = _overlay(frame)
+        goal_node = wff.parse(goal)
+        # Specification only substitutes terms that occur in the goal (or
+        # the premise); letting in the terms of every new theorem too makes
+        # the queue blow up.
+        pool = set([Term('0')])
+        for source in [goal_node, wff.parse(frame.premise) if frame.premise is not None else None]:
+            if source is not None:
+                pool.update(x for x in _parts(source) if isinstance(x, Term))
+        pool = sorted(pool, key=str)
+        # Existence, joining and induction would need to guess too much
+        # going forward, so they're only tried on parts of the goal.
+        wanted = [x for x in _parts(goal_node) if isinstance(x, (Compound, Quantified))]
+        limit = 2 * len(goal) + 10
+        goal_bigrams = _bigrams(goal)
+        known = {}  # theorem -> (rule, premises, depth), for every theorem derived here
+        queue, counter = [], itertools.count()
+
+        def push(s, depth):
+            bigrams = _bigrams(s)
+            similarity = len(bigrams & goal_bigrams) / max(len(bigrams | goal_bigrams), 1)
+            heapq.heappush(queue, (len(s) + round(len(goal) * (1 - similarity)), depth, next(counter), s))
+
+        delta = []  # theorems the workers haven't heard about yet
+
+        def derive(s, rule, premises, checked=False):
+            s = str(s)
+            if len(s) > limit or s in scratch.theorems:
+                return
+            depth = 1 + max(known[p][2] if p in known else 0 for p in premises)
+            if depth > self.max_depth or not wff.is_well_formed_formula(s):
+                return
+            if not checked:
+                self.stats['checked'] += 1
+                if not scratch.follows_by(s, rule, premises):
+                    return
+            self.stats['derived'] += 1
+            scratch.theorems.add(s)
+            known[s] = (rule, premises, depth)
+            push(s, depth)
+            delta.append(s)
+
+        for s in scratch.theorems:
+            push(s, 0)
+        if self._pool is not None:
+            self._pool.reset(scratch, pool, limit, self.max_depth)
+        expanded = 0
+        while queue and goal not in scratch.theorems:
+            if expanded >= self.max_nodes or time.time() > self.deadline:
+                break
+            if self._pool is None:
+                s = heapq.heappop(queue)[3]
+                for t, rule, premises in _consequences(scratch, wff.parse(s), pool):
+                    derive(t, rule, premises)
+                batch = [s]
+            else:
+                batch = [heapq.heappop(queue) for i in range(min(len(queue), 16 * self.workers))]
+                results, checked = self._pool.expand(delta[:], [(x[1], x[3]) for x in batch])
+                del delta[:]
+                self.stats['checked'] += checked
+                for t, rule, premises in results:
+                    derive(t, rule, premises, checked=True)
+            expanded += len(batch)
+            self.stats['expanded'] += len(batch)
+            for x in wanted:
+                for t, rule, premises in self._assemblies(scratch, x):
+                    derive(t, rule, premises)
+        self.stats['frontier'] = len(queue)
+        self.stats['max_frontier'] = max(self.stats['max_frontier'], len(queue))
+        if goal not in scratch.theorems:
+            return False
+        for s, rule, premises in _proof_of(goal, known):
+            self._step(frame, s, rule, premises)
+        return True
+
+    def _assemblies(self, d, x):
+        # Yield (x, rule, premises) if the part x of the goal follows by
+        # joining, existence or induction from theorems already in d.
+        s = str(x)
+        if s in d.theorems:
+            return
+        if isinstance(x, Compound) and x.op == '∧':
+            if str(x.left) in d.theorems and str(x.right) in d.theorems:
+                yield s, 'joining', [str(x.left), str(x.right)]
+        elif isinstance(x, Quantified) and x.quantifier == '∃':
+            if d.is_valid_by_existence(s):
+                for t in d.theorems.theorems_shaped_like(str(x.body)):
+                    if d.follows_by(s, 'existence', [t]):
+                        yield s, 'existence', [t]
+                        return
+        elif isinstance(x, Quantified):
+            u, body = x.variable, x.body
+            base = str(substitute(body, u, Term('0')))
+            step = str(Quantified('∀', u, Compound(body, '⊃', substitute(body, u, Term('S', Term(u))))))
+            if base in d.theorems and step in d.theorems:
+                yield s, 'induction', [base, step]
+
+def _consequences(d, f, pool):
+    # Yield (t, rule, premises) for everything that might follow from f
+    # (and the theorems already in d) by one rule. Specification only
+    # substitutes the terms in pool.
+    if not isinstance(f, Formula):
+        return
+    s = str(f)
+    if isinstance(f, Quantified) and f.quantifier == '∀':
+        for t in pool:
+            if not (t.free_variables & f.body.quantified_variables):
+                yield substitute(f.body, f.variable, t), 'specification', [s]
+    if isinstance(f, Compound) and f.op == '∧':
+        yield f.left, 'separation', [s]
+        yield f.right, 'separation', [s]
+    if isinstance(f, Compound) and f.op == '⊃' and str(f.left) in d.theorems:
+        yield f.right, 'detachment', [str(f.left), s]
+    for y in d.theorems.consequents_of(s):
+        yield y, 'detachment', [s, '<%s⊃%s>' % (s, y)]
+    if isinstance(f, Atom):
+        t, u = str(f.left), str(f.right)
+        yield Atom(f.right, f.left), 'equality', [s]
+        for v in d.theorems.equalities_with_left(u):
+            yield '%s=%s' % (t, v), 'equality', [s, '%s=%s' % (u, v)]
+        for w in d.theorems.equalities_with_right(t):
+            yield '%s=%s' % (w, u), 'equality', ['%s=%s' % (w, t), s]
+        yield Atom(Term('S', f.left), Term('S', f.right)), 'successorship', [s]
+        if f.left.symbol == 'S' and f.right.symbol == 'S':
+            yield Atom(f.left.operands[0], f.right.operands[0]), 'successorship', [s]
+    for u in sorted(f.free_variables):
+        if d.premise is None or u not in wff.get_free_variables(d.premise):
+            yield Quantified('∀', u, f), 'generalization', [s]
+    for rule, a, b in _interchangeable:
+        for rewrite in [_rewriter(a, b), _rewriter(b, a)]:
+            for t in rewrites_of_one_subformula(f, rewrite):
+                yield t, rule, [s]
+    for rewrite in [_remove_double_tilde, _add_double_tilde]:
+        for t in rewrites_of_one_subformula(f, rewrite):
+            yield t, 'double_tilde', [s]
+    for t in rewrites_of_one_subformula(f, _interchange):
+        yield t, 'interchange', [s]
+
+def _proof_of(goal, known):
+    # Return (s, rule, premises) for each step needed to derive goal,
+    # premises first.
+    steps, done = [], set()
+    stack = [(goal, False)]
+    while stack:
+        s, ready = stack.pop()
+        if s in done or s not in known:
+            continue
+        if ready:
+            done.add(s)
+            steps.append((s, known[s][0], known[s][1]))
+        else:
+            stack.append((s, True))
+            stack.extend((p, False) for p in reversed(known[s][1]))
+    return steps
+
+def _without_abandoned_fantasies(records):
+    # An abandoned fantasy leaves nothing behind, so drop it from the record.
+    result, starts = [], []
+    for record in records:
+        if 'fantasy' in record:
+            starts.append(len(result))
+        elif 'abandon_fantasy' in record:
+            del result[starts.pop():]
+            continue
+        elif 'end_fantasy' in record:
+            starts.pop()
+        result.append(record)
+    return result
+
+def replay(records, d):
+    frames = [d]
+    for record in records:
+        if 'step' in record:
+            frames[-1].step(record['step'], rule=record['rule'], using=record.get('using'))
+        elif 'fantasy' in record:
+            frames.append(frames[-1].begin_fantasy(record['fantasy']))
+        else:
+            frames.pop()
+            frames[-1].end_fantasy()
+
+def script(records, name='d'):
+    # The steps as Python, in the style of derivation_examples.py.
+    lines, names = [], [name]
+    for record in records:
+        indent = '    ' * (len(names) - 1)
+        if 'step' in record:
+            using = ', using=%r' % record['using'] if 'using' in record else ''
+            lines.append('%s%s.step(%r, rule=%r%s)' % (indent, names[-1], record['step'], record['rule'], using))
+        elif 'fantasy' in record:
+            names.append('fghijk'[len(names) - 1])
+            lines.append('%swith %s.fantasy(%r) as %s:' % (indent, names[-2], record['fantasy'], names[-1]))
+        else:
+            if lines[-1].endswith(':'):
+                lines.append('%spass' % indent)
+            names.pop()
+    return '\n'.join(lines)
+
+_search = ProofSearch('S0=S0', max_seconds=2)
+assert _search.run() is not None and _search.records[-1]['step'] == 'S0=S0'
+replay(_search.records, Derivation())
+
+_seen = SharedSeenSet(shards=2, slots_per_shard=4)
+assert [_seen.add(s) for s in ['0=0', 'S0=0', '0=0', 'a=a', 'b=b', 'c=c']] == [True, True, False, True, True, True]
+assert '0=0' in _seen and 'S0=S0' not in _seen and len(_seen) <= 6
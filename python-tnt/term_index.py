@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+import wff_quick
+from formula import Atom, Compound, Not, Numeral, Successor, Term, numeral, successors
+
+# A formula is flattened into its preorder, one token per node. A run of
+# S's stays one token that carries its length, as it is in the tree: the
+# numeral S^n0 is ('0', n), and S^k over some other term is ('S', k)
+# followed by that term's tokens. In a pattern, S^k over a wildcard is
+# the one token (RUN, k), which matches any term with at least k S's in
+# front. Each term position also records where its subterm ends, so that
+# a wildcard can skip the whole of it.
+WILDCARD = '*'
+RUN = 'S*'
+
+def _flatten(f, variables=()):
+    tokens, nodes, ends, names = [], [], [], []
+    stack = [f]
+    while stack:
+        x = stack.pop()
+        if isinstance(x, int):
+            ends[x] = len(tokens)
+            continue
+        start = len(tokens)
+        nodes.append(x)
+        if isinstance(x, Numeral):
+            tokens.append(('0', x.n))
+            ends.append(start + 1)
+        elif isinstance(x, Successor):
+            if x.base.is_variable() and x.base.symbol in variables:
+                tokens.append((RUN, x.k))
+                names.append(x.base.symbol)
+                ends.append(start + 1)
+            else:
+                tokens.append(('S', x.k))
+                ends.append(None)
+                stack.append(start)
+                stack.append(x.base)
+        elif isinstance(x, Term):
+            if x.is_variable():
+                if x.symbol in variables:
+                    tokens.append(WILDCARD)
+                    names.append(x.symbol)
+                else:
+                    tokens.append(x.symbol)
+                ends.append(start + 1)
+            else:
+                tokens.append(x.symbol)
+                ends.append(None)
+                stack.append(start)
+                stack.extend(reversed(x.operands))
+        else:
+            if isinstance(x, Atom):
+                tokens.append('=')
+                children = (x.left, x.right)
+            elif isinstance(x, Not):
+                tokens.append('~')
+                children = (x.body,)
+            elif isinstance(x, Compound):
+                tokens.append(x.op)
+                children = (x.left, x.right)
+            else:
+                tokens.append(x.quantifier + x.variable)
+                children = (x.body,)
+            ends.append(None)
+            stack.extend(reversed(children))
+    return tokens, nodes, ends, names
+
+def _subterm(x, k):
+    # What's left of the term x after dropping k S's from its front.
+    if isinstance(x, Numeral):
+        return numeral(x.n - k)
+    elif isinstance(x, Successor):
+        return successors(x.k - k, x.base)
+    return x
+
+class DiscriminationTree:
+    # A trie of patterns' preorders, with WILDCARD for pattern variables.
+    # A lookup costs about the size of the formula, not the number of patterns.
+    def __init__(self):
+        self.root = {}
+        self.size = 0
+
+    def add(self, pattern, variables, value):
+        tokens, nodes, ends, names = _flatten(pattern, variables)
+        node = self.root
+        for token in tokens:
+            if isinstance(token, tuple) and token[0] == RUN:
+                node = node.setdefault(RUN, {}).setdefault(token[1], {})
+            else:
+                node = node.setdefault(token, {})
+        node.setdefault(None, []).append((tuple(names), value))
+        self.size += 1
+
+    def match(self, f):
+        # Yields (value, bindings) for each pattern that f is an instance of.
+        tokens, nodes, ends, names = _flatten(f)
+        n = len(tokens)
+        stack = [(self.root, 0, ())]
+        while stack:
+            node, i, wild = stack.pop()
+            if i == n:
+                for names, value in node.get(None, ()):
+                    bindings = {}
+                    for name, (j, k) in zip(names, wild):
+                        t = _subterm(nodes[j], k)
+                        if bindings.setdefault(name, t) is not t:
+                            break
+                    else:
+                        yield value, bindings
+                continue
+            token = tokens[i]
+            child = node.get(token)
+            if child is not None:
+                stack.append((child, i + 1, wild))
+            if ends[i] is not None:
+                child = node.get(WILDCARD)
+                if child is not None:
+                    stack.append((child, ends[i], wild + ((i, 0),)))
+                runs = node.get(RUN)
+                if runs and isinstance(token, tuple):
+                    for k, child in runs.items():
+                        if k <= token[1]:
+                            stack.append((child, ends[i], wild + ((i, k),)))
+
+_tree = DiscriminationTree()
+_tree.add(wff_quick.parse('(a+Sb)=S(a+b)'), ('a', 'b'), 'plus')
+_tree.add(wff_quick.parse('(a+a)=b'), ('a',), 'double')
+assert list(_tree.match(wff_quick.parse('(S0+SS0)=S(S0+S0)'))) == [('plus', {'a': numeral(1), 'b': numeral(1)})]
+assert list(_tree.match(wff_quick.parse('(S0+S0)=b'))) == [('double', {'a': numeral(1)})]
+assert not list(_tree.match(wff_quick.parse('(S0+0)=b'))) and not list(_tree.match(wff_quick.parse('(S0+S0)=S(0+S0)')))
+assert [v for v, b in _tree.match(wff_quick.parse('(c+Sc)=S(c+c)'))] == ['plus']
+_n = numeral(10**9)
+assert list(_tree.match(Atom(Term('+', Term('a'), _n), successors(1, Term('+', Term('a'), numeral(10**9 - 1)))))) == [
+    ('plus', {'a': Term('a'), 'b': numeral(10**9 - 1)})]
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+import collections
+
+import wff_quick as wff
+from formula import Compound, Formula, Quantified
+from term_index import DiscriminationTree
+
+# Substituting a term for a variable never touches the characters that
+# are left after deleting every term character. So a formula's "shape"
+# is a necessary condition for specification and existence, and it's
+# cheap enough to use as a dictionary key.
+_term_characters = dict.fromkeys(map(ord, '0S()+⋅′abcdefghijklmnopqrstuvwxyz'))
+
+def shape(s):
+    return s.translate(_term_characters)
+
+assert shape('∀a:<(a+Sb′)=0⊃~S0=a>') == '∀:<=⊃~=>'
+
+class TheoremStore:
+    # A bag of theorems, indexed by the keys the rules look them up by.
+    # A child() is an overlay: lookups fall through to the parent.
+    def __init__(self, theorems=(), parent=None):
+        self.parent = parent
+        self.theorems = set()
+        self.formulas = set()
+        self.conjuncts = set()
+        self.antecedents_by_consequent = collections.defaultdict(set)
+        self.consequents_by_antecedent = collections.defaultdict(set)
+        self.universals_by_body_shape = collections.defaultdict(set)
+        self.universals_by_body = DiscriminationTree()
+        self.theorems_by_shape = collections.defaultdict(set)
+        self.equalities_by_left = collections.defaultdict(set)
+        self.equalities_by_right = collections.defaultdict(set)
+        self.theorems_by_length = collections.defaultdict(set)
+        self.theorems_by_tildeless = collections.defaultdict(set)
+        self.malformed = 0
+        for theorem in theorems:
+            self.add(theorem)
+
+    def _layers(self):
+        store = self
+        while store is not None:
+            yield store
+            store = store.parent
+
+    def _lookup(self, index, key):
+        for store in self._layers():
+            yield from getattr(store, index).get(key, ())
+
+    def __contains__(self, s):
+        return any(s in store.theorems for store in self._layers())
+
+    def __iter__(self):
+        for store in self._layers():
+            yield from store.theorems
+
+    def __len__(self):
+        return sum(len(store.theorems) for store in self._layers())
+
+    def add(self, s):
+        if s in self:
+            return
+        self.theorems.add(s)
+        f = wff.parse(s)
+        if f is not None:
+            self.formulas.add(f)
+        if not isinstance(f, Formula):
+            self.malformed += 1
+        if isinstance(f, Compound):
+            if f.op == '∧':
+                self.conjuncts.add(str(f.left))
+                self.conjuncts.add(str(f.right))
+            elif f.op == '⊃':
+                self.antecedents_by_consequent[str(f.right)].add(str(f.left))
+                self.consequents_by_antecedent[str(f.left)].add(str(f.right))
+        if s.startswith('∀'):
+            colon = s.find(':')
+            if colon >= 0:
+                u, x = s[1:colon], s[colon+1:]
+                self.universals_by_body_shape[shape(x)].add((u, x))
+        # ∀u1:…∀uk:x goes into the tree k times: once for each number of
+        # leading quantifiers that a single specification can strip off.
+        us, x = (), f
+        while isinstance(x, Quantified) and x.quantifier == '∀':
+            us, x = us + (x.variable,), x.body
+            self.universals_by_body.add(x, us, (us, x))
+        self.theorems_by_shape[shape(s)].add(s)
+        equals = s.find('=')
+        if equals >= 0:
+            self.equalities_by_left[s[:equals]].add(s[equals+1:])
+            self.equalities_by_right[s[equals+1:]].add(s[:equals])
+        self.theorems_by_length[len(s)].add(s)
+        self.theorems_by_tildeless[s.replace('~', '')].add(s)
+
+    def has_malformed(self):
+        return any(store.malformed for store in self._layers())
+
+    def copy(self):
+        return TheoremStore(self)
+
+    def child(self):
+        return TheoremStore(parent=self)
+
+    def local_theorems(self):
+        return set(self.theorems)
+
+    def contains_formula(self, f):
+        return any(f in store.formulas for store in self._layers())
+
+    def is_conjunct(self, s):
+        return any(s in store.conjuncts for store in self._layers())
+
+    def antecedents_of(self, s):
+        # Every x such that <x⊃s> is in the bag.
+        return self._lookup('antecedents_by_consequent', s)
+
+    def consequents_of(self, s):
+        # Every y such that <s⊃y> is in the bag.
+        return self._lookup('consequents_by_antecedent', s)
+
+    def universals_with_body_shaped_like(self, s):
+        return self._lookup('universals_by_body_shape', shape(s))
+
+    def universals_generalizing(self, f):
+        # (us, x, terms) for each ∀u1:…∀uk:x in the bag that specifies to f.
+        # Capture is the caller's problem.
+        for store in self._layers():
+            for (us, x), terms in store.universals_by_body.match(f):
+                yield us, x, terms
+
+    def theorems_shaped_like(self, s):
+        return self._lookup('theorems_by_shape', shape(s))
+
+    def equalities_with_left(self, t):
+        # Every u such that t=u is in the bag.
+        return self._lookup('equalities_by_left', t)
+
+    def equalities_with_right(self, u):
+        # Every t such that t=u is in the bag.
+        return self._lookup('equalities_by_right', u)
+
+    def theorems_of_length(self, n):
+        return self._lookup('theorems_by_length', n)
+
+    def theorems_differing_only_in_tildes_from(self, s):
+        return self._lookup('theorems_by_tildeless', s.replace('~', ''))
+
+_store = TheoremStore(['<p=0∧~q=0>', '<p=0⊃q=0>', '∀a:∀b:(a+Sb)=S(a+b)'])
+assert _store.is_conjunct('~q=0') and not _store.is_conjunct('q=0')
+assert list(_store.antecedents_of('q=0')) == ['p=0']
+assert not _store.has_malformed() and TheoremStore(['<p=0'], _store).has_malformed()
+assert list(_store.universals_with_body_shaped_like('∀b:(S0+Sb)=S(S0+b)')) == [('a', '∀b:(a+Sb)=S(a+b)')]
+assert [us for us, x, terms in _store.universals_generalizing(wff.parse('(S0+Sb)=S(S0+b)'))] == [('a', 'b')]
+assert [us for us, x, terms in _store.universals_generalizing(wff.parse('∀b:(S0+Sb)=S(S0+b)'))] == [('a',)]
+assert list(_store.equalities_with_left('∀a:∀b:(a+Sb)')) == ['S(a+b)']
+
+_child = _store.child()
+_child.add('<q=0⊃r=0>')
+assert '<p=0⊃q=0>' in _child and '<q=0⊃r=0>' not in _store
+assert sorted(_child.consequents_of('q=0')) == ['r=0'] and list(_child.antecedents_of('q=0')) == ['p=0']
+assert len(_child) == 4 and _child.local_theorems() == set(['<q=0⊃r=0>'])
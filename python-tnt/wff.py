@@ -1,12 +1,13 @@
 # -*- coding: utf-8 -*-
 
+import collections
 import re
 
 def is_alphabetically_correct(s):
     return set(s) <= set('0Sabcdefghijklmnopqrstuvwxyz′(+⋅)=~<∧∨⊃>∀∃:')
 
 def is_numeral(s):
-    return bool(re.match('S*0$', s))
+    return s.lstrip('S') == '0'
 
 assert all(is_numeral(x) for x in ['0', 'S0', 'SS0', 'SSS0', 'SSSS0', 'SSSSS0'])
 
@@ -16,8 +17,7 @@ def is_variable(s):
 assert all(is_variable(x) for x in ['a', 'b′', 'c′′', 'd′′′', 'e′′′′'])
 
 def is_term(s):
-    while s and s[0] == 'S':
-        s = s[1:]
+    s = s.lstrip('S')
     if not s:
         return False
     if s[0] == '(' and s[-1] == ')':
@@ -41,12 +41,13 @@ assert all(is_definite_term(x) for x in ['0', '(S0+S0)', 'SS((SS0⋅SS0)+(S0⋅S
 assert all(is_indefinite_term(x) for x in ['b', 'Sa', '(b′+S0)', '(((S0+S0)⋅S0)+e)'])
 
 class FormulaInfo:
-    def __init__(self, wf, fv, qv):
+    def __init__(self, wf, fv, qv, formula=None):
         assert type(qv) in [type(set()), type(None)]
         assert type(fv) in [type(set()), type(None)]
         self.is_well_formed = wf
         self.free_variables = fv
         self.quantified_variables = qv
+        self.formula = formula
     def __nonzero__(self):
         assert False  # you shouldn't be calling this
 
@@ -89,25 +90,137 @@ def check_quantification(s):
                 return FormulaInfo(True, f.free_variables - set([v]), f.quantified_variables | set([v]))
     return FormulaInfo(False, None, None)
 
-def check_well_formed_formula(s):
+def check_well_formed_formula(s, packrat=False):
+    if packrat:
+        return PackratChecker(s).check()
     for check in [check_atom, check_negation, check_compound, check_quantification]:
         f = check(s)
         if f.is_well_formed:
             return f
     return FormulaInfo(False, None, None)
 
+def memoized(check):
+    def wrap(self, i, j):
+        key = (check, i, j)
+        memo = self.memo
+        if key in memo:
+            memo.move_to_end(key)
+            return memo[key]
+        result = check(self, i, j)
+        memo[key] = result
+        if len(memo) > self.max_entries:
+            memo.popitem(last=False)
+        return result
+    return wrap
+
+class PackratChecker:
+    # The same naive rules as above, but each check takes offsets (i, j)
+    # into the original string instead of a sliced copy, and remembers its
+    # result for each (check, i, j). That makes the whole thing polynomial
+    # rather than exponential. Only the max_entries most recently used
+    # results are remembered.
+    numeral_re = re.compile('S*0$')
+    variable_re = re.compile('[a-z]′*$')
+    variables_re = re.compile('[a-z]′*')
+
+    def __init__(self, s, max_entries=1000000):
+        self.s = s
+        self.memo = collections.OrderedDict()
+        self.max_entries = max_entries
+
+    def check(self):
+        f = self.check_well_formed_formula(0, len(self.s))
+        if f.is_well_formed:
+            return FormulaInfo(True, set(f.free_variables), set(f.quantified_variables))
+        return FormulaInfo(False, None, None)
+
+    def is_numeral(self, i, j):
+        return bool(self.numeral_re.match(self.s, i, j))
+
+    def is_variable(self, i, j):
+        return bool(self.variable_re.match(self.s, i, j))
+
+    def get_free_variables_in_term(self, i, j):
+        return set(self.variables_re.findall(self.s, i, j))
+
+    @memoized
+    def is_term(self, i, j):
+        s = self.s
+        while i < j and s[i] == 'S':
+            i += 1
+        if i == j:
+            return False
+        if s[i] == '(' and s[j-1] == ')':
+            for k in range(i, j):
+                if s[k] in '+⋅' and self.is_term(i+1, k) and self.is_term(k+1, j-1):
+                    return True
+        if self.is_numeral(i, j) or self.is_variable(i, j):
+            return True
+        return False
+
+    @memoized
+    def check_atom(self, i, j):
+        s = self.s
+        for k in range(i, j):
+            if s[k] == '=':
+                if self.is_term(i, k) and self.is_term(k+1, j):
+                    return FormulaInfo(True, self.get_free_variables_in_term(i, k) | self.get_free_variables_in_term(k+1, j), set())
+        return FormulaInfo(False, None, None)
+
+    @memoized
+    def check_negation(self, i, j):
+        if i < j and self.s[i] == '~':
+            return self.check_well_formed_formula(i+1, j)
+        return FormulaInfo(False, None, None)
+
+    @memoized
+    def check_compound(self, i, j):
+        s = self.s
+        if i < j and s[i] == '<' and s[j-1] == '>':
+            for k in range(i, j):
+                if s[k] in '∧∨⊃':
+                    f1 = self.check_well_formed_formula(i+1, k)
+                    f2 = self.check_well_formed_formula(k+1, j-1)
+                    if f1.is_well_formed and f2.is_well_formed:
+                        fv = (f1.free_variables | f2.free_variables)
+                        qv = (f1.quantified_variables | f2.quantified_variables)
+                        if not (fv & qv):
+                            return FormulaInfo(True, fv, qv)
+                        break
+        return FormulaInfo(False, None, None)
+
+    @memoized
+    def check_quantification(self, i, j):
+        s = self.s
+        if i < j and s[i] in '∀∃':
+            colon = s.find(':', i, j)
+            if colon >= 0:
+                v = s[i+1:colon]
+                f = self.check_well_formed_formula(colon+1, j)
+                if self.is_variable(i+1, colon) and f.is_well_formed and (v in f.free_variables):
+                    return FormulaInfo(True, f.free_variables - set([v]), f.quantified_variables | set([v]))
+        return FormulaInfo(False, None, None)
+
+    @memoized
+    def check_well_formed_formula(self, i, j):
+        for check in [self.check_atom, self.check_negation, self.check_compound, self.check_quantification]:
+            f = check(i, j)
+            if f.is_well_formed:
+                return f
+        return FormulaInfo(False, None, None)
+
 assert all(check_negation(x).is_well_formed for x in ['~S0=0', '~∃b:(b+b)=S0', '~<0=0⊃S0=0>', '~b=S0', '~∃c:Sc=d'])
 assert all(check_compound(x).is_well_formed for x in ['<0=0∧~0=0>', '<b=b∨~∃c:c=b>', '<S0=0⊃∀c:~∃b:(b+b)=c>'])
 assert all(check_quantification(x).is_well_formed for x in ['∀b:<b=b∨~∃c:c=b>', '∀c:~∃b:(b+b)=c'])
 
-def is_well_formed_formula(s):
-    return check_well_formed_formula(s).is_well_formed
+def is_well_formed_formula(s, packrat=False):
+    return check_well_formed_formula(s, packrat).is_well_formed
 
-def get_free_variables(s):
-    return check_well_formed_formula(s).free_variables
+def get_free_variables(s, packrat=False):
+    return check_well_formed_formula(s, packrat).free_variables
 
-def get_quantified_variables(s):
-    return check_well_formed_formula(s).quantified_variables
+def get_quantified_variables(s, packrat=False):
+    return check_well_formed_formula(s, packrat).quantified_variables
 
 assert is_well_formed_formula('∀a:a=SSSS0')  # "All natural numbers are equal to 2."
 assert is_well_formed_formula('~∃a:(a⋅a)=a')  # "There is no natural number which equals its own square."
@@ -120,3 +233,9 @@ assert get_quantified_variables('∀c:<∃d:(c⋅d)=b⊃∃d:(d⋅SS0)=c>') == s
 assert get_free_variables('∀c:<∃d:(c⋅d)=b⊃∃d:(d⋅SS0)=c>') == set(['b'])
 assert get_quantified_variables('∀a:<∃a′:(a⋅a′)=a′′⊃∃a′:(a′⋅SS0)=a>') == set(['a', 'a′'])
 assert get_free_variables('∀a:<∃a′:(a⋅a′)=a′′⊃∃a′:(a′⋅SS0)=a>') == set(['a′′'])
+
+assert is_well_formed_formula('<<∃a:a=0∧b=0>⊃~∀c:<c=0∨~c=S0>>', packrat=True)
+assert get_free_variables('∀c:<∃d:(c⋅d)=b⊃∃d:(d⋅SS0)=c>', packrat=True) == set(['b'])
+assert get_quantified_variables('∀a:<∃a′:(a⋅a′)=a′′⊃∃a′:(a′⋅SS0)=a>', packrat=True) == set(['a', 'a′'])
+assert not is_well_formed_formula('<x⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃⊃y>', packrat=True)
+assert not is_well_formed_formula('<<a=0∧∃a:a=0>∨b=0>', packrat=True)
@@ -1,161 +1,295 @@
 # -*- coding: utf-8 -*-
 
-import re
+import argparse
+import atexit
+import collections
+import concurrent.futures
+import functools
+import itertools
+import json
+import sys
 
+import instrument
+from formula import Atom, Compound, Formula, Node, Not, Quantified, Term, successors
 from wff import FormulaInfo, get_free_variables_in_term, is_variable
 
+# Token kinds. Operators get codes of their own, so that the parser
+# can dispatch on small integers instead of re-matching strings.
+NUMERAL, VARIABLE, SUCCESSOR_TERM, SUCCESSORS = range(4)
+LANGLE, RANGLE, LPAREN, RPAREN, PLUS, TIMES, EQUALS, TILDE, AND, OR, IMPLIES, FORALL, EXISTS, COLON = range(4, 18)
+NOTHING = -1
+
+OPERATORS = {
+    '<': LANGLE, '>': RANGLE, '(': LPAREN, ')': RPAREN, '+': PLUS, '⋅': TIMES, '=': EQUALS,
+    '~': TILDE, '∧': AND, '∨': OR, '⊃': IMPLIES, '∀': FORALL, '∃': EXISTS, ':': COLON,
+}
+SYMBOLS = dict((code, ch) for ch, code in OPERATORS.items())
+LOWERCASE = frozenset('abcdefghijklmnopqrstuvwxyz')
+
+def tokenize(s):
+    # Yields (kind, start, end, number of leading S's) for each token.
+    i, length = 0, len(s)
+    while i < length:
+        c = s[i]
+        if c == 'S' or c == '0' or c in LOWERCASE:
+            j = i
+            while j < length and s[j] == 'S':
+                j += 1
+            if j < length and s[j] == '0':
+                yield (NUMERAL, i, j+1, j-i)
+                i = j+1
+            elif j < length and s[j] in LOWERCASE:
+                k = j+1
+                while k < length and s[k] == '′':
+                    k += 1
+                yield (SUCCESSOR_TERM if j > i else VARIABLE, i, k, j-i)
+                i = k
+            else:
+                yield (SUCCESSORS, i, j, j-i)
+                i = j
+        elif c in OPERATORS:
+            yield (OPERATORS[c], i, i+1, 0)
+            i += 1
+        else:
+            raise ValueError('unexpected %r at offset %d' % (c, i))
+
+assert [k for k, i, j, n in tokenize('∀a′:<S(a′+0)=SSb∨~SS0=0>')] == [
+    FORALL, VARIABLE, COLON, LANGLE, SUCCESSORS, LPAREN, VARIABLE, PLUS, NUMERAL, RPAREN,
+    EQUALS, SUCCESSOR_TERM, OR, TILDE, NUMERAL, EQUALS, NUMERAL, RANGLE,
+]
+
+class IllFormed(Exception):
+    pass
+
+@instrument.timed('wff_quick.check_well_formed_formula', size=True)
 def check_well_formed_formula(s):
-    opr, opd = [], []
+    if isinstance(s, Node):
+        return s.info()
+    # Each operand is [kind, start, end, node], where s[start:end] is its
+    # text. Operators are kept as codes in opr, and where they start in
+    # opr_at. Keeping offsets rather than the operands' text means that no
+    # reduction ever copies the text of its operands.
+    opr, opr_at, opd, runs = [], [], [], []
     def opr_top():
-        return opr[-1] if opr else 'X'
-    def opr_push(x):
-        return opr.append(x)
-    def opd_push(x):
-        assert not (x[2] & x[3])
-        return opd.append(x)
+        return opr[-1] if opr else NOTHING
+    def opr_push(kind, at):
+        opr.append(kind)
+        opr_at.append(at)
+    def opr_pop():
+        opr_at.pop()
+        return opr.pop()
+    def adjacent(*offsets):
+        # Every reduction checks that its pieces abut one another, in
+        # order, with nothing left over in between; so the result really
+        # does spell out s[start:end].
+        for i in range(1, len(offsets)):
+            if offsets[i-1] != offsets[i]:
+                raise IllFormed()
+    def reduce_successors():
+        at = opr_at[-1]
+        opr_pop()
+        n = runs.pop()
+        t1 = opd.pop()
+        if t1[0] != 'T': raise IllFormed()
+        adjacent(at + n, t1[1])
+        opd.append(['T', at, t1[2], successors(n, t1[3])])
+    def reduce_atom():
+        t2 = opd.pop()
+        t1 = opd.pop()
+        adjacent(t1[2], opr_at[-1], t2[1] - 1)
+        opr_pop()
+        if t1[0] != 'T' or t2[0] != 'T': raise IllFormed()
+        opd.append(['F', t1[1], t2[2], Atom(t1[3], t2[3])])
+    def reduce_negation():
+        at = opr_at[-1]
+        opr_pop()
+        t1 = opd.pop()
+        if t1[0] != 'F': raise IllFormed()
+        adjacent(at + 1, t1[1])
+        opd.append(['F', at, t1[2], Not(t1[3])])
+    def reduce_quantification():
+        colon = opr_at[-1]
+        opr_pop()
+        x = opd.pop()
+        v = opd.pop()
+        at = opr_at[-1]
+        op = opr_pop()
+        if op != FORALL and op != EXISTS: raise IllFormed()
+        if x[0] != 'F' or v[0] != 'V': raise IllFormed()
+        adjacent(at + 1, v[1])
+        adjacent(v[2], colon, x[1] - 1)
+        u = v[3].symbol
+        if u not in x[3].free_variables: raise IllFormed()  # v must be free in x
+        opd.append(['F', at, x[2], Quantified(SYMBOLS[op], u, x[3])])
+    def reduce_unary_operators():
+        while True:
+            top = opr_top()
+            if top == TILDE:
+                reduce_negation()
+            elif top == COLON:
+                reduce_quantification()
+            else:
+                break
     nope = FormulaInfo(False, set(), set())
     try:
-        for token in re.split('(S*0)|(S*[a-z]′*)|(S+)|(.)', s):
-            if not token:
-                continue
-            if is_variable(token):
-                if opr_top() in '∀∃':
-                    opd_push(['V', token, set([token]), set()])
+        for kind, start, end, n in tokenize(s):
+            if kind == VARIABLE:
+                if opr_top() == FORALL or opr_top() == EXISTS:
+                    opd.append(['V', start, end, Term(s[start:end])])
                 else:
-                    opd_push(['T', token, set([token]), set()])
-            elif re.match('(S*0)|(S*[a-z]′*)', token):
-                opd_push(['T', token, get_free_variables_in_term(token), set()])
-            elif re.match('S+', token):
-                opr_push(token)
-            elif token in '<(∀∃:+⋅~':
-                opr_push(token)
-            elif token == '=':
-                if re.match('S+', opr_top()):
-                    op = opr.pop()
-                    t1 = opd.pop()
-                    if t1[0] != 'T': return nope
-                    opd_push(['T', op + t1[1], t1[2], set()])
-                opr_push(token)
-            elif token == ')':
+                    opd.append(['T', start, end, Term(s[start:end])])
+            elif kind == NUMERAL:
+                opd.append(['T', start, end, successors(n, Term('0'))])
+            elif kind == SUCCESSOR_TERM:
+                opd.append(['T', start, end, successors(n, Term(s[start+n:end]))])
+            elif kind == SUCCESSORS:
+                opr_push(kind, start)
+                runs.append(n)
+            elif kind == EQUALS:
+                if opr_top() == SUCCESSORS:
+                    reduce_successors()
+                opr_push(kind, start)
+            elif kind == RPAREN:
                 t2 = opd.pop()
                 t1 = opd.pop()
-                op = opr.pop()
-                if opr.pop() != '(': return nope
-                if op not in '+⋅': return nope
+                adjacent(t1[2], opr_at[-1], t2[1] - 1)
+                adjacent(t2[2], start)
+                op = opr_pop()
+                adjacent(opr_at[-1] + 1, t1[1])
+                at = opr_at[-1]
+                if opr_pop() != LPAREN: return nope
+                if op != PLUS and op != TIMES: return nope
                 if t1[0] != 'T' or t2[0] != 'T': return nope
-                opd_push(['T', '(%s%s%s)' % (t1[1], op, t2[1]), t1[2] | t2[2], set()])
-                if re.match('S+', opr_top()):
-                    op = opr.pop()
-                    t1 = opd.pop()
-                    opd_push(['T', op + t1[1], t1[2], set()])
-            elif token in '∧∨⊃':
-                if re.match('S+', opr_top()):
-                    op = opr.pop()
-                    t1 = opd.pop()
-                    if t1[0] != 'T': return nope
-                    opd_push(['T', op + t1[1], t1[2], set()])
-                if opr_top() == '=':
-                    t2 = opd.pop()
-                    t1 = opd.pop()
-                    op = opr.pop()
-                    if t1[0] != 'T' or t2[0] != 'T': return nope
-                    opd_push(['F', '%s=%s' % (t1[1], t2[1]), t1[2] | t2[2], set()])
-                while opr_top() in ':~':
-                    op = opr.pop()
-                    if op == '~':
-                        t1 = opd.pop()
-                        if t1[0] != 'F': return nope
-                        opd_push(['F', '~%s' % t1[1], t1[2], t1[3]])
-                    elif op == ':':
-                        x = opd.pop()
-                        v = opd.pop()
-                        op = opr.pop()
-                        if op not in '∀∃': return nope
-                        if x[0] != 'F' or v[0] != 'V': return nope
-                        if v[1] not in x[2]: return nope  # v must be free in x
-                        opd_push(['F', '%s%s:%s' % (op, v[1], x[1]), x[2] - set([v[1]]), x[3] | set([v[1]])])
-                opr_push(token)
-            elif token == '>':
-                if opr_top() == '=':
-                    t2 = opd.pop()
-                    t1 = opd.pop()
-                    op = opr.pop()
-                    if t1[0] != 'T' or t2[0] != 'T': return nope
-                    opd_push(['F', '%s=%s' % (t1[1], t2[1]), t1[2] | t2[2], set()])
-                while opr_top() in ':~':
-                    op = opr.pop()
-                    if op == '~':
-                        t1 = opd.pop()
-                        if t1[0] != 'F': return nope
-                        opd_push(['F', '~%s' % t1[1], t1[2], t1[3]])
-                    elif op == ':':
-                        x = opd.pop()
-                        v = opd.pop()
-                        op = opr.pop()
-                        if op not in '∀∃': return nope
-                        if x[0] != 'F' or v[0] != 'V': return nope
-                        if v[1] not in x[2]: return nope  # v must be free in x
-                        opd_push(['F', '%s%s:%s' % (op, v[1], x[1]), x[2] - set([v[1]]), x[3] | set([v[1]])])
+                opd.append(['T', at, end, Term(SYMBOLS[op], t1[3], t2[3])])
+                if opr_top() == SUCCESSORS:
+                    reduce_successors()
+            elif kind == AND or kind == OR or kind == IMPLIES:
+                if opr_top() == SUCCESSORS:
+                    reduce_successors()
+                if opr_top() == EQUALS:
+                    reduce_atom()
+                reduce_unary_operators()
+                opr_push(kind, start)
+            elif kind == RANGLE:
+                if opr_top() == EQUALS:
+                    reduce_atom()
+                reduce_unary_operators()
                 t2 = opd.pop()
                 t1 = opd.pop()
-                op = opr.pop()
-                if opr.pop() != '<': return nope
-                if op not in '∧∨⊃': return nope
+                adjacent(t1[2], opr_at[-1], t2[1] - 1)
+                adjacent(t2[2], start)
+                op = opr_pop()
+                adjacent(opr_at[-1] + 1, t1[1])
+                at = opr_at[-1]
+                if opr_pop() != LANGLE: return nope
+                if op != AND and op != OR and op != IMPLIES: return nope
                 if t1[0] != 'F' or t2[0] != 'F': return nope
-                fv = (t1[2] | t2[2])
-                qv = (t1[3] | t2[3])
-                if (fv & qv):
+                f1, f2 = t1[3], t2[3]
+                if (f1.free_variables | f2.free_variables) & (f1.quantified_variables | f2.quantified_variables):
                     return nope
-                opd_push(['F', '<%s%s%s>' % (t1[1], op, t2[1]), fv, qv])
+                opd.append(['F', at, end, Compound(f1, SYMBOLS[op], f2)])
             else:
-                assert False
+                # One of <(∀∃:+⋅~
+                opr_push(kind, start)
         while opr:
-            if re.match('S+', opr_top()):
-                op = opr.pop()
-                t1 = opd.pop()
-                if t1[0] != 'T': return nope
-                opd_push(['T', op + t1[1], t1[2], set()])
-            elif opr_top() == '=':
-                t2 = opd.pop()
-                t1 = opd.pop()
-                op = opr.pop()
-                if t1[0] != 'T' or t2[0] != 'T': return nope
-                opd_push(['F', '%s=%s' % (t1[1], t2[1]), t1[2] | t2[2], set()])
-            elif opr_top() == '~':
-                t1 = opd.pop()
-                assert opr.pop() == '~'
-                if t1[0] != 'F': return nope
-                opd_push(['F', '~%s' % t1[1], t1[2], t1[3]])
-            elif opr_top() == ':':
-                x = opd.pop()
-                v = opd.pop()
-                assert opr.pop() == ':'
-                op = opr.pop()
-                if op not in '∀∃': return nope
-                if x[0] != 'F' or v[0] != 'V': return nope
-                if v[1] not in x[2]: return nope  # v must be free in x
-                opd_push(['F', '%s%s:%s' % (op, v[1], x[1]), x[2] - set([v[1]]), x[3] | set([v[1]])])
+            top = opr_top()
+            if top == SUCCESSORS:
+                reduce_successors()
+            elif top == EQUALS:
+                reduce_atom()
+            elif top == TILDE:
+                reduce_negation()
+            elif top == COLON:
+                reduce_quantification()
             else:
                 return nope
         result = opd.pop()
         if opd: return nope
-        if result[1] != s:
-            print('x is', s)
-            print('r is', result[1])
-            assert False
-        return FormulaInfo(result[0] == 'F', result[2], result[3])
-    except IndexError:
-        # Failed to pop something from one of the two stacks.
+        assert (result[1], result[2]) == (0, len(s))
+        f = result[3]
+        return FormulaInfo(result[0] == 'F', set(f.free_variables), set(f.quantified_variables), f)
+    except (IndexError, IllFormed, ValueError):
+        # Failed to pop something from one of the two stacks,
+        # or found something that doesn't belong where it is.
         return nope
 
+@functools.lru_cache(maxsize=65536)
+def parse(s):
+    # Returns the interned Formula (or Term) node for s, or None if s is
+    # neither. Callers that look at the same string over and over again
+    # (such as Derivation) get it parsed only once.
+    return check_well_formed_formula(s).formula
+
+# A formula_cache.FormulaCache that the verdicts below come from, once
+# use_cache() has been called. It only holds verdicts, not syntax trees,
+# so parse() (and so Derivation) still parses.
+_cache = None
+
+def use_cache(path, max_entries=1000000):
+    # Remember verdicts across processes in the sqlite file at path (or
+    # stop, if path is None).
+    global _cache
+    import formula_cache
+    if _cache is not None:
+        _cache.close()
+    _cache = None if path is None else formula_cache.FormulaCache(path, max_entries)
+    _cached.cache_clear()
+
+@atexit.register
+def _close_cache():
+    if _cache is not None:
+        _cache.close()
+
+@functools.lru_cache(maxsize=65536)
+def _cached(s):
+    return _cache.check_well_formed_formula(s)
+
 def is_well_formed_formula(s):
-    return check_well_formed_formula(s).is_well_formed
+    if _cache is not None and isinstance(s, str):
+        return _cached(s).is_well_formed
+    return isinstance(parse(s), Formula)
 
 def get_free_variables(s):
-    return check_well_formed_formula(s).free_variables
+    if _cache is not None and isinstance(s, str):
+        return set(_cached(s).free_variables or ())
+    f = parse(s)
+    return set() if f is None else set(f.free_variables)
 
 def get_quantified_variables(s):
-    return check_well_formed_formula(s).quantified_variables
+    if _cache is not None and isinstance(s, str):
+        return set(_cached(s).quantified_variables or ())
+    f = parse(s)
+    return set() if f is None else set(f.quantified_variables)
+
+def _check_chunk(chunk):
+    # The results are shipped back from a worker process, so leave out
+    # the syntax trees: they're interned per process anyway.
+    result = []
+    for s in chunk:
+        f = check_well_formed_formula(s)
+        result.append(FormulaInfo(f.is_well_formed, f.free_variables, f.quantified_variables))
+    return result
+
+def check_many(formulas, workers=1, chunksize=256):
+    # With workers > 1, a pool checks chunks of formulas, at most two per
+    # worker in flight, so formulas can be a stream. .formula is None.
+    it = iter(formulas)
+    chunks = iter(lambda: list(itertools.islice(it, chunksize)), [])
+    if workers <= 1:
+        for chunk in chunks:
+            for f in _check_chunk(chunk):
+                yield f
+        return
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(pool.submit(_check_chunk, chunk))
+            if len(pending) >= 2 * workers:
+                for f in pending.popleft().result():
+                    yield f
+        while pending:
+            for f in pending.popleft().result():
+                yield f
 
 
 assert is_well_formed_formula('∀a:a=SSSS0')  # "All natural numbers are equal to 2."
@@ -169,3 +303,40 @@ assert get_quantified_variables('∀c:<∃d:(c⋅d)=b⊃∃d:(d⋅SS0)=c>') == s
 assert get_free_variables('∀c:<∃d:(c⋅d)=b⊃∃d:(d⋅SS0)=c>') == set(['b'])
 assert get_quantified_variables('∀a:<∃a′:(a⋅a′)=a′′⊃∃a′:(a′⋅SS0)=a>') == set(['a', 'a′'])
 assert get_free_variables('∀a:<∃a′:(a⋅a′)=a′′⊃∃a′:(a′⋅SS0)=a>') == set(['a′′'])
+
+assert parse('∀a:∀b:<~a=b⊃~Sa=Sb>') is parse('∀a:∀b:' + '<~a=b⊃~Sa=Sb>')
+assert str(parse('∃a:∃x:<x=(d⋅SSy)∧y=S(a+Se)>')) == '∃a:∃x:<x=(d⋅SSy)∧y=S(a+Se)>'
+assert check_well_formed_formula(parse('<0=0∧~a=b>')).free_variables == set(['a', 'b'])
+assert [f.is_well_formed for f in check_many(['0=0', '0=', '∀a:a=a'], chunksize=2)] == [True, False, True]
+
+def _read_lines(paths):
+    for path in paths:
+        with (sys.stdin if path == '-' else open(path, encoding='utf-8')) as lines:
+            for line in lines:
+                yield line.rstrip('\r\n')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check one formula of TNT per line, writing one JSON verdict per line.')
+    parser.add_argument('files', nargs='*', default=['-'], help='files to read (default: standard input)')
+    parser.add_argument('-j', '--workers', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--chunksize', type=int, default=256, help='formulas per unit of work')
+    parser.add_argument('--cache', metavar='PATH', help='remember verdicts in this sqlite file across runs')
+    options = parser.parse_args()
+    lines = _read_lines(options.files)
+    lines, formulas = itertools.tee(lines)
+    if options.cache:
+        import formula_cache
+        cache = formula_cache.FormulaCache(options.cache)
+        results = cache.check_many(formulas, options.workers, options.chunksize)
+    else:
+        results = check_many(formulas, options.workers, options.chunksize)
+    for s, f in zip(lines, results):
+        json.dump({
+            'formula': s,
+            'well_formed': f.is_well_formed,
+            'free_variables': sorted(f.free_variables),
+            'quantified_variables': sorted(f.quantified_variables),
+        }, sys.stdout, ensure_ascii=False)
+        sys.stdout.write('\n')
+    if options.cache:
+        cache.close()
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import random
+import sys
+
+import arithmetic
+import wff_quick
+from derivation import Derivation, InvalidStep
+from formula import Atom, Compound, Not, Quantified, Term, numeral, substitute, successors
+
+# Seeded generators of synthetic inputs: random well-formed formulas,
+# near misses that aren't quite well-formed, and long derivations. They
+# all stream, so that a corpus can be written to a file as it's made.
+
+def random_term(rng, depth, variables):
+    if depth <= 1 or rng.random() < 0.4:
+        if variables and rng.random() < 0.6:
+            t = Term(rng.choice(variables))
+        else:
+            t = numeral(rng.randrange(4))
+    else:
+        t = Term(rng.choice('+⋅'), random_term(rng, depth - 1, variables), random_term(rng, depth - 1, variables))
+    return successors(rng.randrange(1, 3) if rng.random() < 0.2 else 0, t)
+
+def random_formula(rng, size=8, depth=8, quantifier_density=0.2, variables='abcde'):
+    # Variables either only occur free or only under their one quantifier,
+    # as wff_quick requires.
+    pool = list(variables)
+    rng.shuffle(pool)
+    split = len(pool) - max(1, round(len(pool) * quantifier_density)) if quantifier_density else len(pool)
+    free, quantifiable = pool[:split], pool[split:]
+
+    def atom(bound, depth):
+        usable = free + sorted(bound)
+        return Atom(random_term(rng, min(depth, 4), usable), random_term(rng, min(depth, 4), usable))
+
+    def build(size, depth, bound):
+        unbound = [v for v in quantifiable if v not in bound]
+        if unbound and depth > 1 and rng.random() < quantifier_density:
+            v = rng.choice(unbound)
+            body = build(size, depth - 1, bound | set([v]))
+            if v not in body.free_variables:
+                body = Compound(Atom(Term(v), random_term(rng, 2, free + sorted(bound))), rng.choice('∧∨⊃'), body)
+            return Quantified(rng.choice('∀∃'), v, body)
+        if size <= 1 or depth <= 1:
+            f = atom(bound, depth)
+            return Not(f) if rng.random() < 0.2 else f
+        if rng.random() < 0.15:
+            return Not(build(size, depth - 1, bound))
+        left = rng.randrange(1, size)
+        return Compound(build(left, depth - 1, bound), rng.choice('∧∨⊃'), build(size - left, depth - 1, bound))
+
+    return build(size, depth, frozenset())
+
+def formulas(seed, count, **kwargs):
+    rng = random.Random(seed)
+    for i in range(count):
+        yield str(random_formula(rng, **kwargs))
+
+_SYMBOLS = '0S=+⋅()<>∧∨⊃~∀∃:′abc'
+
+def _mutate(rng, s):
+    i = rng.randrange(len(s))
+    kind = rng.randrange(5)
+    if kind == 0:
+        return s[:i] + s[i+1:]
+    elif kind == 1:
+        return s[:i] + rng.choice(_SYMBOLS) + s[i:]
+    elif kind == 2:
+        return s[:i] + s[i+1:i+2] + s[i:i+1] + s[i+2:]
+    elif kind == 3:
+        return s[:i] + rng.choice(_SYMBOLS) + s[i+1:]
+    # Quantify a variable that isn't free (perhaps one that's quantified already).
+    return '%s%s:%s' % (rng.choice('∀∃'), rng.choice('abcdefz'), s)
+
+def near_misses(seed, count, **kwargs):
+    # Well-formed formulas with one small change that breaks them.
+    rng = random.Random(seed)
+    made = 0
+    while made < count:
+        s = _mutate(rng, str(random_formula(rng, **kwargs)))
+        if not wff_quick.check_well_formed_formula(s).is_well_formed:
+            made += 1
+            yield s
+
+def derivation(seed, steps=1000, variables='abcde', max_length=160):
+    # Records of a random derivation, in Journal's format; every step is
+    # checked by a Derivation as it's made.
+    rng = random.Random(seed)
+    variables = list(variables)  # no primes, so that the rules' string replacements are exact
+    d = Derivation()
+    frames = [(d, list(d.theorems))]
+    emitted = [0]
+
+    def take(s, rule):
+        s = str(s)
+        d, known = frames[-1]
+        if len(s) > max_length or s in d.theorems or not wff_quick.is_well_formed_formula(s):
+            return []
+        try:
+            d.step(s, rule=rule)
+        except InvalidStep:
+            return []
+        known.append(s)
+        emitted[0] += 1
+        return [{'step': s, 'rule': rule}]
+
+    def move():
+        d, known = frames[-1]
+        s = rng.choice(known)
+        f = wff_quick.parse(s)
+        kind = rng.randrange(12)
+        if kind == 0:
+            m, n = rng.randrange(6), rng.randrange(6)
+            op = rng.choice('+⋅')
+            lemma = '%s=%s' % (Term(op, numeral(m), numeral(n)), numeral(m + n if op == '+' else m * n))
+            records = []
+            for x, rule in arithmetic.chain(lemma):
+                if x not in d.theorems:
+                    records += take(x, rule)
+            return records
+        elif kind == 1 and isinstance(f, Quantified) and f.quantifier == '∀':
+            usable = [v for v in variables if v not in f.body.quantified_variables]
+            return take(substitute(f.body, f.variable, random_term(rng, 3, usable)), 'specification')
+        elif kind == 2 and f.free_variables:
+            return take(Quantified('∀', rng.choice(sorted(f.free_variables)), f), 'generalization')
+        elif kind == 3:
+            return take('<%s∧%s>' % (s, rng.choice(known)), 'joining')
+        elif kind == 4 and isinstance(f, Compound) and f.op == '∧':
+            return take(rng.choice([f.left, f.right]), 'separation')
+        elif kind == 5:
+            return take('~~' + s, 'double_tilde')
+        elif kind == 6 and isinstance(f, Atom):
+            return take(Atom(f.right, f.left), 'equality')
+        elif kind == 7 and isinstance(f, Atom):
+            return take(Atom(successors(1, f.left), successors(1, f.right)), 'successorship')
+        elif kind == 8 and f.free_variables:
+            v = rng.choice(sorted(f.free_variables))
+            u = rng.choice([u for u in variables if u not in s] or ['z'])
+            return take('∃%s:%s' % (u, s.replace(v, u)), 'existence')
+        elif kind == 9 and isinstance(f, Compound) and f.op == '⊃':
+            records = take(Compound(Not(f.right), '⊃', Not(f.left)), 'contrapositive')
+            if isinstance(f.left, Not):
+                records += take(Compound(f.left.body, '∨', f.right), 'switcheroo')
+            if str(f.left) in d.theorems:
+                records += take(f.right, 'detachment')
+            return records
+        elif kind == 10 and len(frames) < 3:
+            # A short fantasy, whose premise is sometimes a theorem already,
+            # so that detachment has something to work with later.
+            premise = s if rng.random() < 0.5 else str(random_formula(rng, 2, 4, 0.3, variables))
+            f = d.begin_fantasy(premise)
+            frames.append((f, known + [premise]))
+            records = [{'fantasy': premise}]
+            for i in range(rng.randrange(1, 6)):
+                records += move()
+            if not wff_quick.is_well_formed_formula('<%s⊃%s>' % (premise, f.conclusion)):
+                # The conclusion quantifies a variable that's free in the
+                # premise; conclude the premise itself instead.
+                f.step(premise, rule='carry_over')
+                records.append({'step': premise, 'rule': 'carry_over'})
+            frames.pop()
+            d.end_fantasy()
+            known.append(d.conclusion)
+            emitted[0] += 1
+            return records + [{'end_fantasy': True}]
+        return []
+
+    while emitted[0] < steps:
+        for record in move():
+            yield record
+
+def write_lines(path, lines):
+    # To path, or stdout for '-'.
+    f = sys.stdout if path == '-' else open(path, 'w', encoding='utf-8')
+    try:
+        for line in lines:
+            f.write(line)
+            f.write('\n')
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+_rng = random.Random(0)
+assert all(wff_quick.is_well_formed_formula(str(random_formula(_rng, 12, 8, 0.5))) for i in range(200))
+assert not any(wff_quick.is_well_formed_formula(s) for s in near_misses(1, 100))
+_records = list(derivation(2, steps=300))
+assert sum('step' in r for r in _records) + sum('end_fantasy' in r for r in _records) >= 300
+assert list(formulas(3, 5)) == list(formulas(3, 5))
+
+def _agrees_with_every_rule(records):
+    # Replays records, checking that justify() accepts exactly what trying
+    # every rule would: for each step, and for the next few steps and the
+    # step's negation, which mostly don't follow yet.
+    steps = [r['step'] for r in records if 'step' in r]
+    frames, i = [Derivation()], 0
+    for record in records:
+        d = frames[-1]
+        if 'step' in record:
+            for s in steps[i:i + 4] + ['~' + record['step']]:
+                every_rule = s in d.theorems or any(getattr(d, 'is_valid_by_' + rule)(s) for rule in d.rules)
+                if (d.justify(s) is not None) != every_rule:
+                    return False
+            d.step(record['step'], rule=record['rule'])
+            i += 1
+        elif 'fantasy' in record:
+            frames.append(d.begin_fantasy(record['fantasy']))
+        else:
+            frames.pop()
+            frames[-1].end_fantasy()
+    return True
+
+assert all(_agrees_with_every_rule(list(derivation(seed, steps=300))) for seed in range(3))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic corpus of TNT formulas or derivations, one per line.')
+    parser.add_argument('kind', choices=['formulas', 'near-misses', 'derivation'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--count', type=int, default=1000, help='how many formulas, or derivation steps')
+    parser.add_argument('--size', type=int, default=8, help='atoms per formula')
+    parser.add_argument('--depth', type=int, default=8, help='how deeply formulas nest')
+    parser.add_argument('--quantifiers', type=float, default=0.2, help='the chance of each subformula being quantified')
+    parser.add_argument('--variables', default='abcde', help='the variable pool')
+    parser.add_argument('--out', default='-', help='the file to write (default: stdout)')
+    args = parser.parse_args()
+    shape = dict(size=args.size, depth=args.depth, quantifier_density=args.quantifiers, variables=args.variables)
+    if args.kind == 'formulas':
+        lines = formulas(args.seed, args.count, **shape)
+    elif args.kind == 'near-misses':
+        lines = near_misses(args.seed, args.count, **shape)
+    else:
+        lines = (json.dumps(r, ensure_ascii=False) for r in derivation(args.seed, args.count, args.variables))
+    write_lines(args.out, lines)